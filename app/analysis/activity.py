@@ -0,0 +1,60 @@
+import numpy as np
+
+from app.utils.storage import get_mean, get_scaling, load_measures, read_summary
+
+# Number of traces processed at once
+CHUNK_SIZE = 1024
+
+
+class Activity:
+    """Mean activity of traces: the mean of the absolute values of the recentered traces, in volts"""
+
+    def __init__(self):
+        """Initialize empty accumulators"""
+        self.count = 0
+        self.total = 0.0
+
+    def update(self, traces: np.ndarray, y_mult: float = 1):
+        """Add traces to the accumulators
+
+        Args:
+            traces: array of traces, of shape (traces, samples)
+            y_mult: volts per unit of the traces
+        """
+        for start in range(0, len(traces), CHUNK_SIZE):
+            chunk = np.asarray(traces[start : start + CHUNK_SIZE], dtype=np.float64)
+            self.total += np.abs(chunk - chunk.mean(axis=1, keepdims=True)).mean(axis=1).sum() * y_mult
+            self.count += len(chunk)
+
+    def merge(self, other: "Activity"):
+        """Add the accumulators of another activity
+
+        Args:
+            other: the other activity
+        """
+        self.count += other.count
+        self.total += other.total
+
+    def value(self) -> float:
+        """Get the mean activity of the traces"""
+        return self.total / self.count if self.count else 0
+
+
+def activity_chunk(out_directory: str, filename: str, start: int = 0, stop: int | None = None) -> Activity:
+    """Get the activity of a range of measures of a point. Points acquired in average capture only have
+    their mean trace
+
+    Args:
+        out_directory: output directory
+        filename: base name of the files of the point
+        start, stop: range of the measures
+
+    Returns:
+        The activity of the measures
+    """
+    summary = read_summary(out_directory, filename)
+    mean = get_mean(summary)
+    measures = mean[None] if mean is not None else load_measures(out_directory, filename, summary)
+    activity = Activity()
+    activity.update(measures[start:stop], float(get_scaling(summary)[0]))
+    return activity
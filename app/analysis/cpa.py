@@ -0,0 +1,154 @@
+import numpy as np
+
+from app.analysis.leakage import hypotheses
+from app.utils.storage import load_info, load_measures, read_summary
+
+# Number of traces of each matrix product
+CHUNK_SIZE = 4096
+
+# Memory of the accumulators, in bytes per sample of the traces: sums of x, x² and h·x
+ACCUMULATOR_SIZE = 8 * (2 + 16 * 256)
+
+
+class CPA:
+    """
+    Correlation power analysis of the S-box output of the first AES round, with a Hamming weight leakage model,
+    for the 256 key guesses of the 16 bytes at once, or of a subset of the bytes.
+
+    Traces are accumulated as sums of x, x², h, h² and h·x (x: samples, h: leakage hypotheses), so that memory
+    does not depend on the number of traces. The h·x sums are updated by chunks, with one matrix product of
+    the (bytes x 256, traces) hypotheses by the (traces, samples) chunk.
+    """
+
+    def __init__(self, samples: int, key_bytes: list[int] | None = None):
+        """Initialize empty accumulators
+
+        Args:
+            samples: number of samples of the traces
+            key_bytes: analysed bytes of the key, the 16 bytes by default
+        """
+        self.key_bytes = np.arange(16) if key_bytes is None else np.asarray(key_bytes)
+        self.count = 0
+        self.sum_x = np.zeros(samples)
+        self.sum_x2 = np.zeros(samples)
+        self.sum_h = np.zeros((len(self.key_bytes), 256))
+        self.sum_h2 = np.zeros((len(self.key_bytes), 256))
+        self.sum_hx = np.zeros((len(self.key_bytes), 256, samples))
+
+    def update(self, traces: np.ndarray, plaintexts: np.ndarray):
+        """Add traces to the accumulators
+
+        Args:
+            traces: array of traces, of shape (traces, samples)
+            plaintexts: uint8 array of the plaintexts of the traces, of shape (traces, 16)
+        """
+        for start in range(0, len(traces), CHUNK_SIZE):
+            x = np.asarray(traces[start : start + CHUNK_SIZE], dtype=np.float64)
+            h = hypotheses(plaintexts[start : start + CHUNK_SIZE, self.key_bytes]).astype(np.float64)
+            self.count += len(x)
+            self.sum_x += x.sum(axis=0)
+            self.sum_x2 += np.einsum("ij,ij->j", x, x)
+            self.sum_h += h.sum(axis=2)
+            self.sum_h2 += np.einsum("bgi,bgi->bg", h, h)
+            self.sum_hx += (h.reshape(-1, len(x)) @ x).reshape(self.sum_hx.shape)
+
+    def merge(self, other: "CPA"):
+        """Add the accumulators of another analysis of the same samples
+
+        Args:
+            other: the other analysis, of the same bytes
+        """
+        self.count += other.count
+        self.sum_x += other.sum_x
+        self.sum_x2 += other.sum_x2
+        self.sum_h += other.sum_h
+        self.sum_h2 += other.sum_h2
+        self.sum_hx += other.sum_hx
+
+    def correlation(self) -> np.ndarray:
+        """Get the correlation of the leakage hypotheses with the samples
+
+        Returns:
+            Array of Pearson correlation coefficients, of shape (bytes, 256, samples)
+        """
+        n = max(self.count, 1)
+        mean_x, mean_h = self.sum_x / n, self.sum_h / n
+        var_x = np.maximum(self.sum_x2 / n - mean_x**2, 0)
+        var_h = np.maximum(self.sum_h2 / n - mean_h**2, 0)
+        cov = self.sum_hx / n - mean_h[:, :, None] * mean_x
+        with np.errstate(divide="ignore", invalid="ignore"):
+            corr = cov / np.sqrt(var_h[:, :, None] * var_x)
+        return np.nan_to_num(corr, nan=0, posinf=0, neginf=0)
+
+    def scores(self) -> np.ndarray:
+        """Get the score of each key guess: its maximum absolute correlation over the samples
+
+        Returns:
+            Array of scores, of shape (bytes, 256)
+        """
+        return np.abs(self.correlation()).max(axis=2)
+
+    def best_guess(self) -> np.ndarray:
+        """Get the key guess with the highest score, for each analysed byte
+
+        Returns:
+            uint8 array of the guessed key bytes, of shape (bytes,)
+        """
+        return self.scores().argmax(axis=1).astype(np.uint8)
+
+    def key_rank(self, key: np.ndarray) -> np.ndarray:
+        """Get the rank of the correct key byte among the guesses, for each analysed byte
+
+        Args:
+            key: uint8 array of the correct key, of shape (16,)
+
+        Returns:
+            Array of ranks, of shape (bytes,): 0 if the correct key byte has the highest score
+        """
+        scores = self.scores()
+        correct = scores[np.arange(len(self.key_bytes)), np.asarray(key)[self.key_bytes]]
+        return (scores > correct[:, None]).sum(axis=1)
+
+
+def cpa_point(out_directory: str, filename: str, channel: str | None = None) -> CPA:
+    """Run a correlation power analysis on the measures of a point
+
+    Args:
+        out_directory: output directory
+        filename: base name of the files of the point
+        channel: channel of the measures, for points acquired on several channels
+
+    Returns:
+        The analysis, with the accumulators of every measure of the point
+    """
+    summary = read_summary(out_directory, filename)
+    measures = load_measures(out_directory, filename, summary, channel)
+    _, plaintexts, _ = load_info(out_directory, filename)
+    count = min(len(measures), len(plaintexts))
+    cpa = CPA(measures.shape[1])
+    cpa.update(measures[:count], plaintexts[:count])
+    return cpa
+
+
+def cpa_chunk(
+    out_directory: str, filename: str, start: int = 0, stop: int | None = None, channel: str | None = None
+) -> CPA:
+    """Run a correlation power analysis on a range of measures of a point, see run_analysis
+
+    Args:
+        out_directory: output directory
+        filename: base name of the files of the point
+        start, stop: range of the measures
+        channel: channel of the measures, for points acquired on several channels
+
+    Returns:
+        The analysis, with the accumulators of the range of measures
+    """
+    summary = read_summary(out_directory, filename)
+    measures = load_measures(out_directory, filename, summary, channel)
+    _, plaintexts, _ = load_info(out_directory, filename)
+    count = min(len(measures), len(plaintexts))
+    stop = count if stop is None else min(stop, count)
+    cpa = CPA(measures.shape[1])
+    cpa.update(measures[start:stop], plaintexts[start:stop])
+    return cpa
@@ -0,0 +1,176 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from app.analysis.cpa import CHUNK_SIZE, CPA
+from app.analysis.template import Templates, TemplateScores
+from app.utils.storage import load_info, load_measures, read_summary
+
+# Default number of random orders of the measures
+DEFAULT_PERMUTATIONS = 20
+
+# Default number of trace counts of the curves
+DEFAULT_STEPS = 20
+
+
+def trace_counts(total: int, steps: int = DEFAULT_STEPS, first: int = 10) -> np.ndarray:
+    """Get geometrically spaced trace counts
+
+    Args:
+        total: number of traces, the last count
+        steps: maximum number of counts
+        first: first count
+
+    Returns:
+        Sorted array of distinct trace counts
+    """
+    first = max(1, min(first, total))
+    return np.unique(np.geomspace(first, total, steps).round().astype(np.int64))
+
+
+class RankCurves:
+    """Rank of the correct key byte after each trace count, for several random orders of the measures"""
+
+    def __init__(self, counts: np.ndarray, ranks: np.ndarray):
+        """Initialize the curves
+
+        Args:
+            counts: trace counts, of shape (counts,)
+            ranks: rank of the correct key byte, of shape (permutations, counts), 0 for the highest score
+        """
+        self.counts = counts
+        self.ranks = ranks
+
+    def guessing_entropy(self) -> np.ndarray:
+        """Get the guessing entropy after each trace count: the mean rank of the correct key byte, counted from 1
+
+        Returns:
+            Array of guessing entropies, of shape (counts,)
+        """
+        return self.ranks.mean(axis=0) + 1
+
+    def success_rate(self, order: int = 1) -> np.ndarray:
+        """Get the success rate after each trace count
+
+        Args:
+            order: number of best guesses among which the correct key byte must be
+
+        Returns:
+            Array of the fraction of orders of the measures which succeed, of shape (counts,)
+        """
+        return (self.ranks < order).mean(axis=0)
+
+    def traces_to_rank(self, rank: int = 0, rate: float = 0.9) -> int:
+        """Get the number of traces needed to reach a rank for a fraction of the orders of the measures
+
+        Args:
+            rank: maximum rank of the correct key byte
+            rate: fraction of the orders of the measures
+
+        Returns:
+            The first trace count from which the rate is reached, or None if it is never reached
+        """
+        reached = self.success_rate(rank + 1) >= rate
+        stable = np.flip(np.logical_and.accumulate(np.flip(reached)))
+        return int(self.counts[stable.argmax()]) if stable.any() else None
+
+
+def _rank_permutation(
+    out_directory: str,
+    filename: str,
+    templates: Templates,
+    key: np.ndarray,
+    counts: np.ndarray,
+    byte: int,
+    window: list[int],
+    channel: str,
+    seed: np.random.SeedSequence,
+) -> np.ndarray:
+    """Get the rank of the correct key byte after each trace count, for one random order of the measures. The
+    accumulators of an analysis are updated with the measures added between two counts only, by chunks, and the
+    correlation power analysis only accumulates the attacked byte
+
+    Returns:
+        Array of ranks, of shape (counts,)
+    """
+    summary = read_summary(out_directory, filename)
+    measures = load_measures(out_directory, filename, summary, channel)
+    _, plaintexts, _ = load_info(out_directory, filename)
+    # The points of interest of templates are indexes in the full traces: only the CPA is restricted to the window
+    start, stop = window if window is not None and templates is None else (0, measures.shape[1])
+    order = np.random.default_rng(seed).permutation(counts[-1])
+
+    analysis = CPA(stop - start, [byte]) if templates is None else TemplateScores(templates)
+    ranks = np.empty(len(counts), dtype=np.int64)
+    previous = 0
+    for i, count in enumerate(counts):
+        # Measures are read in the order of the file, their order within the range does not change the accumulators
+        indexes = np.sort(order[previous:count])
+        for chunk in range(0, len(indexes), CHUNK_SIZE):
+            chunk_indexes = indexes[chunk : chunk + CHUNK_SIZE]
+            analysis.update(measures[chunk_indexes, start:stop], plaintexts[chunk_indexes])
+        rank = analysis.key_rank(key)
+        ranks[i] = rank if templates is not None else rank[0]
+        previous = count
+    return ranks
+
+
+def rank_curves(
+    out_directory: str,
+    filename: str,
+    templates: Templates = None,
+    key: np.ndarray = None,
+    byte: int = 0,
+    window: list[int] | None = None,
+    channel: str | None = None,
+    counts: np.ndarray = None,
+    permutations: int = DEFAULT_PERMUTATIONS,
+    seed: int | None = None,
+    workers: int | None = None,
+    progress=None,
+) -> RankCurves:
+    """Get the rank of the correct key byte of the measures of a point, after increasing trace counts, for several
+    random orders of the measures analysed in a pool of processes. The attack is a correlation power analysis,
+    or a template attack if templates are given
+
+    Args:
+        out_directory: output directory
+        filename: base name of the files of the point
+        templates: templates of the attacked byte, for a template attack
+        key: uint8 array of the correct key, of shape (16,), the key returned by the target board by default
+        byte: attacked byte, for a correlation power analysis
+        window: [start, stop] samples analysed by the correlation power analysis, every sample by default. Ignored
+            by a template attack, which analyses the points of interest of the templates
+        channel: channel of the measures, for points acquired on several channels
+        counts: trace counts of the curves, see trace_counts() by default
+        permutations: number of random orders of the measures
+        seed: seed of the random orders, for reproducible curves
+        workers: number of processes, the number of cpus by default
+        progress: function to call with (analysed orders, total orders)
+
+    Returns:
+        The rank curves
+    """
+    summary = read_summary(out_directory, filename)
+    if "mean" in summary:
+        raise ValueError("Points acquired in average capture have no measures to rank")
+    keys, plaintexts, _ = load_info(out_directory, filename)
+    total = min(len(load_measures(out_directory, filename, summary, channel)), len(plaintexts))
+    if not total:
+        raise ValueError(f"No measures in {filename}")
+    key = keys[0] if key is None else np.asarray(key, dtype=np.uint8)
+    counts = trace_counts(total) if counts is None else np.asarray(counts)
+    if counts[-1] > total:
+        raise ValueError(f"Not enough measures in {filename}: {total} < {counts[-1]}")
+
+    seeds = np.random.SeedSequence(seed).spawn(permutations)
+    ranks = np.empty((permutations, len(counts)), dtype=np.int64)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        args = (out_directory, filename, templates, key, counts, byte, window, channel)
+        futures = {executor.submit(_rank_permutation, *args, seed): i for i, seed in enumerate(seeds)}
+        for done, future in enumerate(as_completed(futures), 1):
+            ranks[futures[future]] = future.result()
+            if progress is not None:
+                progress(done, permutations)
+    return RankCurves(counts, ranks)
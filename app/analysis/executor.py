@@ -0,0 +1,114 @@
+import collections
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from app.utils.storage import list_points, load_measures, read_summary
+
+# Default memory used by the chunks of traces being analysed, in bytes
+DEFAULT_MEMORY_BUDGET = 2 * 1024 * 1024 * 1024
+
+# Number of float64 copies of a chunk held by an analysis (traces, squares, products...)
+WORKING_COPIES = 4
+
+# Number of copies of the accumulators of a chunk held at once: in its process, in transit, then merged by the parent
+ACCUMULATOR_COPIES = 3
+
+
+def plan_chunks(
+    out_directory: str, filenames: list[str], memory_budget: int, workers: int, accumulator_size: int = 0
+) -> list[tuple[str, int, int]]:
+    """Split the measures of points into chunks which fit in the memory budget when analysed in parallel, with the
+    accumulators of the analysis. Chunks keep at least half of the budget of a process when the accumulators do not
+    fit in the other half
+
+    Args:
+        out_directory: output directory
+        filenames: base names of the files of the points
+        memory_budget: memory used by the chunks being analysed, in bytes
+        workers: number of chunks analysed in parallel
+        accumulator_size: memory of the accumulators of the analysis, in bytes per sample of the traces
+
+    Returns:
+        List of (filename, start, stop) ranges of measures
+    """
+    chunks = []
+    for filename in filenames:
+        summary = read_summary(out_directory, filename)
+        if summary is None:
+            continue
+        # Points acquired in average capture only have their mean trace
+        count = 1 if "mean" in summary else len(load_measures(out_directory, filename, summary))
+        trace_size = int(summary["samples"]) * 8 * WORKING_COPIES
+        accumulators = int(summary["samples"]) * accumulator_size * ACCUMULATOR_COPIES
+        available = max(memory_budget // workers - accumulators, memory_budget // workers // 2)
+        size = max(1, available // trace_size)
+        chunks.extend((filename, start, min(start + size, count)) for start in range(0, count, size))
+    return chunks
+
+
+def run_analysis(
+    analysis,
+    out_directory: str,
+    filenames: list[str] | None = None,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET,
+    workers: int | None = None,
+    progress=None,
+    accumulator_size: int = 0,
+    finalize=None,
+) -> dict:
+    """Run an analysis over the measures of an output directory, by chunks analysed in a pool of processes.
+    Chunks are read from memory-mapped measures, so that campaigns larger than the memory can be analysed.
+    The accumulators of a point can be finalized as soon as all its chunks are merged, so that the accumulators
+    of every point are not held until the end
+
+    Args:
+        analysis: picklable function (out_directory, filename, start, stop) returning the accumulators of a range
+            of measures of a point, with a merge() method (eg: activity_chunk, cpa_chunk)
+        out_directory: output directory
+        filenames: base names of the files of the points to analyse, every point by default
+        memory_budget: memory used by the chunks being analysed, in bytes
+        workers: number of processes, the number of cpus by default
+        progress: function to call with (analysed chunks, total chunks)
+        accumulator_size: memory of the accumulators of the analysis, in bytes per sample of the traces
+            (eg: cpa.ACCUMULATOR_SIZE), see plan_chunks()
+        finalize: function to call with (filename, accumulators) once every chunk of a point is merged (eg: to save
+            them), whose result replaces the accumulators of the point
+
+    Returns:
+        Dict of {filename: accumulators} of each point, or of {filename: result of finalize}
+    """
+    filenames = list_points(out_directory) if filenames is None else filenames
+    workers = workers or os.cpu_count()
+    chunks = plan_chunks(out_directory, filenames, memory_budget, workers, accumulator_size)
+    remaining = collections.Counter(filename for filename, _, _ in chunks)
+
+    results, pending = {}, set()
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        tasks = iter(chunks)
+        while True:
+            # At most one chunk per process is submitted, to stay within the memory budget
+            for filename, start, stop in tasks:
+                future = executor.submit(analysis, out_directory, filename, start, stop)
+                future.filename = filename
+                pending.add(future)
+                if len(pending) >= workers:
+                    break
+            if not pending:
+                break
+
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                result = future.result()
+                if future.filename in results:
+                    results[future.filename].merge(result)
+                else:
+                    results[future.filename] = result
+                remaining[future.filename] -= 1
+                if finalize is not None and not remaining[future.filename]:
+                    results[future.filename] = finalize(future.filename, results[future.filename])
+                done += 1
+            if progress is not None:
+                progress(done, len(chunks))
+    return results
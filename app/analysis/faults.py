@@ -0,0 +1,110 @@
+import os
+import statistics
+
+import numpy as np
+
+from app.utils.storage import SUMMARY_EXT, list_points, load_errors, point_coords
+
+
+def _point_errors(out_directory: str, filename: str) -> tuple[int, np.ndarray]:
+    """Get the number of runs of a point and the error counts of its runs with errors, reading only the error
+    counts of its summary, without unpacking sparse counts"""
+    path = os.path.join(out_directory, f"{filename}.{SUMMARY_EXT}")
+    if os.path.isfile(path):
+        with np.load(path) as summary:
+            if "runs" in summary.files:
+                counts = summary["errors"] if "errors" in summary.files else summary["errors_count"]
+                return int(summary["runs"]), counts[counts != 0]
+    errors = load_errors(out_directory, filename)
+    return len(errors), errors[errors != 0]
+
+
+def fault_table(out_directory: str, filenames: list[str] | None = None) -> dict:
+    """Get the error statistics of the points of an output directory, as arrays over the points
+
+    Args:
+        out_directory: output directory
+        filenames: base names of the files of the points, every point by default (including older acquisitions
+            which store the errors as text)
+
+    Returns:
+        Dict of arrays: "coords" (points, 2), "runs", "faulty" (runs with errors), "errors" (total error count),
+        and "counts" (error counts of the runs with errors, concatenated over the points)
+    """
+    if filenames is None:
+        ext = ".errors.txt"
+        legacy = [file[: -len(ext)] for file in os.listdir(out_directory) if file.endswith(ext)]
+        filenames = sorted(set(list_points(out_directory)) | set(legacy))
+    points = [_point_errors(out_directory, filename) for filename in filenames]
+    return {
+        "coords": np.array([point_coords(filename) for filename in filenames], dtype=np.float64).reshape(-1, 2),
+        "runs": np.array([runs for runs, _ in points], dtype=np.int64),
+        "faulty": np.array([len(counts) for _, counts in points], dtype=np.int64),
+        "errors": np.array([counts.sum() for _, counts in points], dtype=np.float64),
+        "counts": np.concatenate([counts for _, counts in points]) if points else np.zeros(0),
+    }
+
+
+def fault_rate_map(out_directory: str, metric: str = "mean", table: dict | None = None) -> dict:
+    """Get the fault rate of every point of an output directory
+
+    Args:
+        out_directory: output directory
+        metric: "mean" for the mean error count per run, or "rate" for the fraction of runs with errors
+        table: error statistics of the points, see fault_table(), read if not given
+
+    Returns:
+        Dict of {(x,y): rate} for each point
+    """
+    table = table if table is not None else fault_table(out_directory)
+    if metric not in ("mean", "rate"):
+        raise ValueError(f"Invalid fault rate metric: {metric}")
+    values = table["errors"] if metric == "mean" else table["faulty"]
+    rates = values / np.maximum(table["runs"], 1)
+    return {tuple(coords): float(rate) for coords, rate in zip(table["coords"].tolist(), rates, strict=True)}
+
+
+def error_histogram(table: dict) -> np.ndarray:
+    """Get the histogram of the error counts of the runs of the points
+
+    Args:
+        table: error statistics of the points, see fault_table()
+
+    Returns:
+        Array of the number of runs with each error count, from 0 errors to the maximum error count
+    """
+    histogram = np.bincount(np.rint(table["counts"]).astype(np.int64), minlength=1)
+    histogram[0] += table["runs"].sum() - table["faulty"].sum()
+    return histogram
+
+
+def wilson_interval(successes, runs, confidence: float = 0.95) -> tuple:
+    """Get the Wilson score interval of a fraction of runs, which stays informative when no or every run succeeds
+
+    Args:
+        successes: number of successful runs, or array of numbers
+        runs: number of runs, or array of numbers
+        confidence: confidence level of the interval
+
+    Returns:
+        Tuple of (lower bound, upper bound), with the shape of the arguments
+    """
+    z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+    n = np.maximum(runs, 1)
+    p = successes / n
+    center = (p + z**2 / (2 * n)) / (1 + z**2 / n)
+    half_width = z * np.sqrt(p * (1 - p) / n + z**2 / (4 * n**2)) / (1 + z**2 / n)
+    return np.clip(center - half_width, 0, 1), np.clip(center + half_width, 0, 1)
+
+
+def fault_intervals(table: dict, confidence: float = 0.95) -> tuple[np.ndarray, np.ndarray]:
+    """Get the confidence interval of the fraction of runs with errors of each point (Wilson score interval)
+
+    Args:
+        table: error statistics of the points, see fault_table()
+        confidence: confidence level of the intervals
+
+    Returns:
+        Tuple of (lower bounds, upper bounds), arrays of shape (points,)
+    """
+    return wilson_interval(table["faulty"], table["runs"], confidence)
@@ -0,0 +1,153 @@
+import os
+
+import numpy as np
+
+from app.analysis.leakage import sbox_output
+from app.utils.storage import load_info, load_measures, read_summary
+
+# Number of traces of each matrix product
+CHUNK_SIZE = 4096
+
+# Memory of the accumulators of 256 classes, in bytes per sample of the traces: sums of x and x²
+ACCUMULATOR_SIZE = 8 * 2 * 256
+
+SNR_EXT = "snr.npz"
+
+
+class SNR:
+    """
+    Signal to noise ratio of the samples of traces grouped by a leakage label (eg: an S-box output byte): the variance
+    of the mean of the classes, relative to the mean of the variance within the classes.
+
+    Traces are accumulated as the count, sum of x and sum of x² of each class, so that memory does not depend on
+    the number of traces. Sums are updated by chunks, with one matrix product of the (classes, traces) one-hot
+    labels by the (traces, samples) chunk.
+    """
+
+    def __init__(self, samples: int, classes: int = 256):
+        """Initialize empty accumulators
+
+        Args:
+            samples: number of samples of the traces
+            classes: number of values of the label
+        """
+        self.count = np.zeros(classes, dtype=np.int64)
+        self.sum_x = np.zeros((classes, samples))
+        self.sum_x2 = np.zeros((classes, samples))
+
+    def update(self, traces: np.ndarray, labels: np.ndarray):
+        """Add traces to the accumulators
+
+        Args:
+            traces: array of traces, of shape (traces, samples)
+            labels: array of the label of each trace, of shape (traces,)
+        """
+        for start in range(0, len(traces), CHUNK_SIZE):
+            x = np.asarray(traces[start : start + CHUNK_SIZE], dtype=np.float64)
+            label = np.asarray(labels[start : start + CHUNK_SIZE], dtype=np.intp)
+            one_hot = np.zeros((len(self.count), len(x)))
+            one_hot[label, np.arange(len(x))] = 1
+            self.count += np.bincount(label, minlength=len(self.count))
+            self.sum_x += one_hot @ x
+            self.sum_x2 += one_hot @ (x * x)
+
+    def merge(self, other: "SNR"):
+        """Add the accumulators of another analysis of the same samples
+
+        Args:
+            other: the other analysis
+        """
+        self.count += other.count
+        self.sum_x += other.sum_x
+        self.sum_x2 += other.sum_x2
+
+    def snr(self) -> np.ndarray:
+        """Get the signal to noise ratio of each sample, over the classes which have traces
+
+        Returns:
+            Array of signal to noise ratios, of shape (samples,)
+        """
+        present = self.count > 0
+        if present.sum() < 2:
+            return np.zeros(self.sum_x.shape[1])
+        n = self.count[present, None]
+        mean = self.sum_x[present] / n
+        noise = np.maximum(self.sum_x2[present] / n - mean**2, 0).mean(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            snr = mean.var(axis=0) / noise
+        return np.nan_to_num(snr, nan=0, posinf=0, neginf=0)
+
+    def max_snr(self) -> float:
+        """Get the maximum signal to noise ratio over the samples"""
+        return float(self.snr().max(initial=0))
+
+
+def snr_chunk(
+    out_directory: str,
+    filename: str,
+    start: int = 0,
+    stop: int | None = None,
+    channel: str | None = None,
+    byte: int = 0,
+) -> SNR:
+    """Get the signal to noise ratio of a range of measures of a point, grouped by the S-box output of the first AES
+    round, from the key and plaintext returned by the target board, see run_analysis
+
+    Args:
+        out_directory: output directory
+        filename: base name of the files of the point
+        start, stop: range of the measures
+        channel: channel of the measures, for points acquired on several channels
+        byte: byte of the S-box output used as label
+
+    Returns:
+        The analysis, with the accumulators of the range of measures
+    """
+    summary = read_summary(out_directory, filename)
+    measures = load_measures(out_directory, filename, summary, channel)
+    keys, plaintexts, _ = load_info(out_directory, filename)
+    count = min(len(measures), len(plaintexts))
+    stop = count if stop is None else min(stop, count)
+    snr = SNR(measures.shape[1])
+    snr.update(measures[start:stop], sbox_output(plaintexts[start:stop], keys[start:stop])[:, byte])
+    return snr
+
+
+def snr_point(out_directory: str, filename: str, channel: str | None = None, byte: int = 0) -> SNR:
+    """Get the signal to noise ratio of the measures of a point, see snr_chunk(). The accumulators are cached
+    in the output directory, so that only the measures added since the last call are read
+
+    Args:
+        out_directory: output directory
+        filename: base name of the files of the point
+        channel: channel of the measures, for points acquired on several channels
+        byte: byte of the S-box output used as label
+
+    Returns:
+        The analysis, with the accumulators of every measure of the point
+    """
+    path = os.path.join(out_directory, f"{filename}.{SNR_EXT}")
+    snr = None
+    if os.path.isfile(path):
+        with np.load(path) as cache:
+            if str(cache["channel"]) == str(channel) and int(cache["byte"]) == byte:
+                snr = SNR(cache["sum_x"].shape[1])
+                snr.count, snr.sum_x, snr.sum_x2 = cache["count"], cache["sum_x"], cache["sum_x2"]
+
+    # The cache is dropped when the measures have been truncated or acquired again with other settings
+    measures = load_measures(out_directory, filename, channel=channel)
+    start = int(snr.count.sum()) if snr is not None else 0
+    if start > len(measures) or (snr is not None and snr.sum_x.shape[1] != measures.shape[1]):
+        snr, start = None, 0
+    new = snr_chunk(out_directory, filename, start, channel=channel, byte=byte)
+    if snr is None:
+        snr = new
+    elif new.count.any():
+        snr.merge(new)
+    else:
+        return snr
+
+    with open(path + ".tmp", mode="wb") as f:
+        np.savez(f, channel=str(channel), byte=byte, count=snr.count, sum_x=snr.sum_x, sum_x2=snr.sum_x2)
+    os.replace(path + ".tmp", path)
+    return snr
@@ -0,0 +1,201 @@
+import functools
+import os
+
+import numpy as np
+
+from app.analysis.executor import DEFAULT_MEMORY_BUDGET, run_analysis
+from app.utils.storage import get_mean, get_scaling, list_points, load_measures, point_coords, read_summary
+
+# Number of traces of each batched FFT
+CHUNK_SIZE = 1024
+
+SPECTRUM_EXT = "spectrum.npz"
+
+
+class Spectrum:
+    """
+    Mean power spectrum of traces, from the batched real FFT of each chunk of traces. The spectrum is accumulated as
+    the sum of the squared magnitude of each frequency bin, so that memory does not depend on the number of traces,
+    and the power in any band is then integrated without reading the traces again.
+    """
+
+    def __init__(self, samples: int):
+        """Initialize empty accumulators
+
+        Args:
+            samples: number of samples of the traces
+        """
+        self.samples = samples
+        self.count = 0
+        self.power = np.zeros(samples // 2 + 1)
+
+    def update(self, traces: np.ndarray):
+        """Add traces to the accumulators
+
+        Args:
+            traces: array of traces, of shape (traces, samples)
+        """
+        for start in range(0, len(traces), CHUNK_SIZE):
+            x = np.asarray(traces[start : start + CHUNK_SIZE], dtype=np.float64)
+            spectra = np.fft.rfft(x, axis=1)
+            self.power += (spectra.real**2 + spectra.imag**2).sum(axis=0)
+            self.count += len(x)
+
+    def merge(self, other: "Spectrum"):
+        """Add the accumulators of another spectrum of the same samples
+
+        Args:
+            other: the other spectrum
+        """
+        self.count += other.count
+        self.power += other.power
+
+    def band_power(self, low: float, high: float, x_incr: float, y_mult: float = 1) -> float:
+        """Get the mean power of the traces in a frequency band (Parseval's theorem)
+
+        Args:
+            low, high: bounds of the band, in Hz
+            x_incr: seconds per sample
+            y_mult: volts per unit of the traces
+
+        Returns:
+            The mean power in the band, in V² (mean square of the band-limited traces)
+        """
+        if not self.count:
+            return 0
+        freqs = np.fft.rfftfreq(self.samples, x_incr)
+        weights = np.full(len(freqs), 2.0)  # one-sided spectrum: bins other than DC and Nyquist count twice
+        weights[0] = 1
+        if self.samples % 2 == 0:
+            weights[-1] = 1
+        band = (freqs >= low) & (freqs <= high)
+        return float((self.power[band] * weights[band]).sum() / self.count / self.samples**2 * y_mult**2)
+
+
+def spectrum_chunk(
+    out_directory: str, filename: str, start: int = 0, stop: int | None = None, channel: str | None = None
+) -> Spectrum:
+    """Get the power spectrum of a range of measures of a point, see run_analysis. Points acquired in average capture
+    only have their mean trace
+
+    Args:
+        out_directory: output directory
+        filename: base name of the files of the point
+        start, stop: range of the measures
+        channel: channel of the measures, for points acquired on several channels
+
+    Returns:
+        The spectrum of the measures
+    """
+    summary = read_summary(out_directory, filename)
+    mean = get_mean(summary, channel)
+    measures = mean[None] if mean is not None else load_measures(out_directory, filename, summary, channel)
+    spectrum = Spectrum(measures.shape[1])
+    spectrum.update(measures[start:stop])
+    return spectrum
+
+
+def _trace_count(out_directory: str, filename: str, summary: dict, channel: str | None = None) -> int:
+    """Get the number of traces of a point: its measures, or its mean trace in average capture"""
+    return 1 if "mean" in summary else len(load_measures(out_directory, filename, summary, channel))
+
+
+def _load_spectrum(out_directory: str, filename: str, channel: str | None = None) -> Spectrum:
+    """Load the cached spectrum of a point, or None if the point has no spectrum for the channel"""
+    path = os.path.join(out_directory, f"{filename}.{SPECTRUM_EXT}")
+    if not os.path.isfile(path):
+        return None
+    with np.load(path) as cache:
+        if str(cache["channel"]) != str(channel):
+            return None
+        spectrum = Spectrum(int(cache["samples"]))
+        spectrum.count, spectrum.power = int(cache["count"]), cache["power"]
+    return spectrum
+
+
+def _save_spectrum(out_directory: str, filename: str, spectrum: Spectrum, channel: str | None = None):
+    """Cache the spectrum of a point"""
+    path = os.path.join(out_directory, f"{filename}.{SPECTRUM_EXT}")
+    with open(path + ".tmp", mode="wb") as f:
+        np.savez(f, channel=str(channel), samples=spectrum.samples, count=spectrum.count, power=spectrum.power)
+    os.replace(path + ".tmp", path)
+
+
+def spectrum_point(out_directory: str, filename: str, channel: str | None = None) -> Spectrum:
+    """Get the power spectrum of the measures of a point, see spectrum_chunk(). The spectrum is cached in the output
+    directory, so that only the measures added since the last call are read
+
+    Args:
+        out_directory: output directory
+        filename: base name of the files of the point
+        channel: channel of the measures, for points acquired on several channels
+
+    Returns:
+        The spectrum of every measure of the point
+    """
+    summary = read_summary(out_directory, filename)
+    count = _trace_count(out_directory, filename, summary, channel)
+    spectrum = _load_spectrum(out_directory, filename, channel)
+
+    # The cache is dropped when the measures have been truncated or acquired again with other settings
+    if spectrum is None or spectrum.count > count or spectrum.samples != int(summary["samples"]):
+        spectrum = spectrum_chunk(out_directory, filename, channel=channel)
+    elif spectrum.count < count:
+        spectrum.merge(spectrum_chunk(out_directory, filename, spectrum.count, channel=channel))
+    else:
+        return spectrum
+    _save_spectrum(out_directory, filename, spectrum, channel)
+    return spectrum
+
+
+def band_power_point(out_directory: str, filename: str, band: list[float], channel: str | None = None) -> float:
+    """Get the mean power of the measures of a point in a frequency band, in V²
+
+    Args:
+        out_directory: output directory
+        filename: base name of the files of the point
+        band: [low, high] bounds of the band, in Hz
+        channel: channel of the measures, for points acquired on several channels
+
+    Returns:
+        The mean power in the band
+    """
+    y_mult, _, _, x_incr = get_scaling(read_summary(out_directory, filename), channel)
+    return spectrum_point(out_directory, filename, channel).band_power(*band, x_incr, y_mult)
+
+
+def band_power_map(
+    out_directory: str,
+    band: list[float],
+    channel: str | None = None,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET,
+    workers: int | None = None,
+    progress=None,
+) -> dict:
+    """Get the mean power of every point of an output directory in a frequency band. Spectra which are not cached
+    are computed by run_analysis(), then any band is scored from the cache. A single outdated point, such as
+    the point being acquired, is updated in this process
+
+    Args:
+        out_directory: output directory
+        band: [low, high] bounds of the band, in Hz
+        channel: channel of the measures, for points acquired on several channels
+        memory_budget, workers, progress: see run_analysis()
+
+    Returns:
+        Dict of {(x,y): power} for each point
+    """
+    filenames = list_points(out_directory)
+    outdated = []
+    for filename in filenames:
+        spectrum = _load_spectrum(out_directory, filename, channel)
+        count = _trace_count(out_directory, filename, read_summary(out_directory, filename), channel)
+        if spectrum is None or spectrum.count != count:
+            outdated.append(filename)
+
+    if len(outdated) > 1:
+        analysis = functools.partial(spectrum_chunk, channel=channel)
+        save = functools.partial(_save_spectrum, out_directory, channel=channel)
+        run_analysis(analysis, out_directory, outdated, memory_budget, workers, progress, finalize=save)
+
+    return {point_coords(filename): band_power_point(out_directory, filename, band, channel) for filename in filenames}
@@ -0,0 +1,334 @@
+import functools
+import os
+
+import numpy as np
+
+from app.analysis.executor import DEFAULT_MEMORY_BUDGET, run_analysis
+from app.analysis.leakage import SBOX, sbox_output
+from app.analysis.snr import ACCUMULATOR_SIZE, snr_chunk
+from app.utils.storage import load_info, load_measures, read_summary
+
+# Number of traces matched at once
+CHUNK_SIZE = 4096
+
+# Default number of points of interest of the templates
+DEFAULT_POIS = 8
+
+
+def select_pois(snr: np.ndarray, n: int, spacing: int = 1) -> np.ndarray:
+    """Select the samples of highest signal to noise ratio
+
+    Args:
+        snr: signal to noise ratio of each sample
+        n: number of points of interest
+        spacing: minimum distance between two points of interest, in samples
+
+    Returns:
+        Sorted array of the indexes of the points of interest
+    """
+    pois = []
+    for index in np.argsort(snr)[::-1]:
+        if all(abs(index - poi) >= spacing for poi in pois):
+            pois.append(index)
+            if len(pois) == n:
+                break
+    return np.sort(np.array(pois, dtype=np.intp))
+
+
+class Profile:
+    """
+    Profiling of Gaussian templates on points of interest: the mean of each class and a covariance pooled over
+    the classes. Traces are accumulated as the count and sum of each class and the sum of the x·xᵀ products,
+    so that memory does not depend on the number of traces.
+    """
+
+    def __init__(self, pois: np.ndarray, classes: int = 256):
+        """Initialize empty accumulators
+
+        Args:
+            pois: indexes of the points of interest in the traces
+            classes: number of values of the label
+        """
+        self.pois = np.asarray(pois)
+        self.count = np.zeros(classes, dtype=np.int64)
+        self.sum_x = np.zeros((classes, len(self.pois)))
+        self.sum_xx = np.zeros((len(self.pois), len(self.pois)))
+
+    def update(self, traces: np.ndarray, labels: np.ndarray):
+        """Add traces to the accumulators
+
+        Args:
+            traces: array of traces, of shape (traces, samples)
+            labels: array of the label of each trace, of shape (traces,)
+        """
+        for start in range(0, len(traces), CHUNK_SIZE):
+            x = np.asarray(traces[start : start + CHUNK_SIZE][:, self.pois], dtype=np.float64)
+            label = np.asarray(labels[start : start + CHUNK_SIZE], dtype=np.intp)
+            one_hot = np.zeros((len(self.count), len(x)))
+            one_hot[label, np.arange(len(x))] = 1
+            self.count += np.bincount(label, minlength=len(self.count))
+            self.sum_x += one_hot @ x
+            self.sum_xx += x.T @ x
+
+    def merge(self, other: "Profile"):
+        """Add the accumulators of another profiling on the same points of interest
+
+        Args:
+            other: the other profiling
+        """
+        self.count += other.count
+        self.sum_x += other.sum_x
+        self.sum_xx += other.sum_xx
+
+    def templates(self, byte: int = 0) -> "Templates":
+        """Build the templates of the profiled classes
+
+        Args:
+            byte: byte of the S-box output used as label
+
+        Returns:
+            The templates
+        """
+        present = self.count > 0
+        if present.sum() < 2:
+            raise ValueError("At least 2 classes must be profiled")
+        means = np.zeros(self.sum_x.shape)
+        means[present] = self.sum_x[present] / self.count[present, None]
+        scatter = self.sum_xx - (means.T * self.count) @ means
+        cov = scatter / (self.count.sum() - present.sum())
+        return Templates(self.pois, means, cov, present, byte)
+
+
+class Templates:
+    """Gaussian templates of the S-box output of a key byte, with a pooled covariance"""
+
+    def __init__(self, pois: np.ndarray, means: np.ndarray, cov: np.ndarray, present: np.ndarray, byte: int = 0):
+        """Initialize the templates
+
+        Args:
+            pois: indexes of the points of interest in the traces
+            means: mean of each class, of shape (classes, points of interest)
+            cov: pooled covariance, of shape (points of interest, points of interest)
+            present: whether each class has been profiled, of shape (classes,)
+            byte: byte of the S-box output used as label
+        """
+        self.pois, self.means, self.cov, self.present, self.byte = np.asarray(pois), means, cov, present, byte
+        self._inv = np.linalg.pinv(cov, hermitian=True)
+        sign, logdet = np.linalg.slogdet(cov)
+        self._norm = -0.5 * (len(self.pois) * np.log(2 * np.pi) + (logdet if sign > 0 else 0))
+        self._projected = means @ self._inv  # (classes, points of interest)
+        self._offsets = -0.5 * np.einsum("cp,cp->c", self._projected, means) + self._norm
+
+    def log_likelihood(self, traces: np.ndarray) -> np.ndarray:
+        """Get the log-likelihood of traces for every class, by chunks of traces
+
+        Args:
+            traces: array of traces, of shape (traces, samples)
+
+        Returns:
+            Array of log-likelihoods, of shape (traces, classes), -inf for the classes which have not been profiled
+        """
+        result = np.empty((len(traces), len(self.means)))
+        for start in range(0, len(traces), CHUNK_SIZE):
+            x = np.asarray(traces[start : start + CHUNK_SIZE][:, self.pois], dtype=np.float64)
+            quadratic = -0.5 * np.einsum("np,pq,nq->n", x, self._inv, x)
+            result[start : start + len(x)] = quadratic[:, None] + x @ self._projected.T + self._offsets
+        result[:, ~self.present] = -np.inf
+        return result
+
+    def key_scores(self, traces: np.ndarray, plaintexts: np.ndarray) -> np.ndarray:
+        """Get the log-likelihood of each key guess, summed over the traces
+
+        Args:
+            traces: array of traces, of shape (traces, samples)
+            plaintexts: uint8 array of the plaintexts of the traces, of shape (traces, 16)
+
+        Returns:
+            Array of scores, of shape (256,), the highest score being the most likely key byte
+        """
+        likelihood = self.log_likelihood(traces)
+        labels = SBOX[plaintexts[:, self.byte, None] ^ np.arange(256, dtype=np.uint8)]  # (traces, guesses)
+        return np.take_along_axis(likelihood, labels.astype(np.intp), axis=1).sum(axis=0)
+
+
+class TemplateScores:
+    """
+    Template attack of a key byte: the log-likelihood of each key guess, summed over the matched traces, so that
+    traces can be added by chunks like the accumulators of the other analyses
+    """
+
+    def __init__(self, templates: Templates):
+        """Initialize empty scores
+
+        Args:
+            templates: the templates
+        """
+        self.templates = templates
+        self.count = 0
+        self.scores = np.zeros(256)
+
+    def update(self, traces: np.ndarray, plaintexts: np.ndarray):
+        """Add traces to the scores
+
+        Args:
+            traces: array of traces, of shape (traces, samples)
+            plaintexts: uint8 array of the plaintexts of the traces, of shape (traces, 16)
+        """
+        self.count += len(traces)
+        self.scores += self.templates.key_scores(traces, plaintexts)
+
+    def merge(self, other: "TemplateScores"):
+        """Add the scores of another attack with the same templates
+
+        Args:
+            other: the other attack
+        """
+        self.count += other.count
+        self.scores += other.scores
+
+    def key_rank(self, key: np.ndarray) -> int:
+        """Get the rank of the correct key byte among the guesses
+
+        Args:
+            key: uint8 array of the correct key, of shape (16,)
+
+        Returns:
+            0 if the correct key byte has the highest score
+        """
+        return int((self.scores > self.scores[key[self.templates.byte]]).sum())
+
+
+class _Total:
+    """Accumulators merged over the points as soon as each point is complete, see run_analysis()"""
+
+    def __init__(self):
+        self.accumulators = None
+
+    def __call__(self, filename: str, accumulators):
+        if self.accumulators is None:
+            self.accumulators = accumulators
+        else:
+            self.accumulators.merge(accumulators)
+
+
+def profile_chunk(
+    out_directory: str,
+    filename: str,
+    start: int = 0,
+    stop: int | None = None,
+    pois=None,
+    channel: str | None = None,
+    byte: int = 0,
+) -> Profile:
+    """Profile a range of measures of a point, labelled by the S-box output of a key byte, from the key and plaintext
+    returned by the target board, see run_analysis
+
+    Args:
+        out_directory: output directory
+        filename: base name of the files of the point
+        start, stop: range of the measures
+        pois: indexes of the points of interest in the traces
+        channel: channel of the measures, for points acquired on several channels
+        byte: byte of the S-box output used as label
+
+    Returns:
+        The profiling, with the accumulators of the range of measures
+    """
+    summary = read_summary(out_directory, filename)
+    measures = load_measures(out_directory, filename, summary, channel)
+    keys, plaintexts, _ = load_info(out_directory, filename)
+    count = min(len(measures), len(plaintexts))
+    stop = count if stop is None else min(stop, count)
+    profile = Profile(pois)
+    profile.update(measures[start:stop], sbox_output(plaintexts[start:stop], keys[start:stop])[:, byte])
+    return profile
+
+
+def profile_templates(
+    out_directory: str,
+    filenames: list[str],
+    pois: int = DEFAULT_POIS,
+    spacing: int = 1,
+    channel: str | None = None,
+    byte: int = 0,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET,
+    workers: int | None = None,
+    progress=None,
+) -> Templates:
+    """Build templates from the measures of profiling points, in two passes: the signal to noise ratio selects
+    the points of interest, then the templates are profiled on them
+
+    Args:
+        out_directory: output directory
+        filenames: base names of the files of the profiling points
+        pois: number of points of interest
+        spacing: minimum distance between two points of interest, in samples
+        channel: channel of the measures, for points acquired on several channels
+        byte: byte of the S-box output used as label
+        memory_budget, workers, progress: see run_analysis()
+
+    Returns:
+        The templates
+    """
+    snr = _Total()
+    run_analysis(
+        functools.partial(snr_chunk, channel=channel, byte=byte),
+        out_directory,
+        filenames,
+        memory_budget,
+        workers,
+        progress,
+        ACCUMULATOR_SIZE,
+        snr,
+    )
+    selected = select_pois(snr.accumulators.snr(), pois, spacing)
+
+    profile = _Total()
+    run_analysis(
+        functools.partial(profile_chunk, pois=selected, channel=channel, byte=byte),
+        out_directory,
+        filenames,
+        memory_budget,
+        workers,
+        progress,
+        finalize=profile,
+    )
+    return profile.accumulators.templates(byte)
+
+
+def save_templates(path: str, templates: Templates):
+    """Save templates to a .npz file, atomically"""
+    with open(path + ".tmp", mode="wb") as f:
+        np.savez(
+            f,
+            pois=templates.pois,
+            means=templates.means,
+            cov=templates.cov,
+            present=templates.present,
+            byte=templates.byte,
+        )
+    os.replace(path + ".tmp", path)
+
+
+def load_templates(path: str) -> Templates:
+    """Load templates saved by save_templates()"""
+    with np.load(path) as cache:
+        return Templates(cache["pois"], cache["means"], cache["cov"], cache["present"], int(cache["byte"]))
+
+
+def match_point(out_directory: str, filename: str, templates: Templates, channel: str | None = None) -> np.ndarray:
+    """Match the measures of a point against templates
+
+    Args:
+        out_directory: output directory
+        filename: base name of the files of the point
+        templates: the templates
+        channel: channel of the measures, for points acquired on several channels
+
+    Returns:
+        Array of the log-likelihood of each key guess, of shape (256,)
+    """
+    measures = load_measures(out_directory, filename, channel=channel)
+    _, plaintexts, _ = load_info(out_directory, filename)
+    count = min(len(measures), len(plaintexts))
+    return templates.key_scores(measures[:count], plaintexts[:count])
@@ -0,0 +1,216 @@
+import itertools
+import os
+
+import numpy as np
+
+from app.utils.storage import load_measures, read_summary
+
+# Default settings of the fixed-vs-random leakage assessment
+DEFAULT_TVLA_SETTINGS = {
+    "store": True,  # whether to store the traces, or only the t-test accumulators of each point
+    "threshold": 4.5,  # absolute t-statistic above which a sample is considered as leaking
+}
+
+# Classes of the traces, as tagged by the target board
+FIXED, RANDOM = 0, 1
+
+# Number of traces of each update of the moments
+CHUNK_SIZE = 4096
+
+# Memory of the accumulators of 2 classes, in bytes per sample of the traces: mean, M2, M3 and M4
+ACCUMULATOR_SIZE = 8 * 2 * 4
+
+TVLA_EXT = "tvla.npz"
+
+
+class TVLA:
+    """
+    Welch's t-test between the traces of fixed and random inputs (Test Vector Leakage Assessment), at the first
+    and second order, for each sample.
+
+    Each class is accumulated in one pass as its count, mean and centered moment sums M2, M3, M4, so that memory
+    does not depend on the number of traces. Batches of traces are combined with the accumulators using the
+    pairwise update of the moments (Pébay), which is the batch form of Welford's algorithm, by chunks of traces.
+    """
+
+    def __init__(self, samples: int):
+        """Initialize empty accumulators
+
+        Args:
+            samples: number of samples of the traces
+        """
+        self.count = np.zeros(2, dtype=np.int64)
+        self.mean = np.zeros((2, samples))
+        self.m2 = np.zeros((2, samples))
+        self.m3 = np.zeros((2, samples))
+        self.m4 = np.zeros((2, samples))
+
+    def _combine(self, c: int, n: int, mean: np.ndarray, m2: np.ndarray, m3: np.ndarray, m4: np.ndarray):
+        """Combine the moments of a set of traces with the accumulators of a class"""
+        na, nb = float(self.count[c]), float(n)
+        if nb == 0:
+            return
+        total = na + nb
+        d = mean - self.mean[c]
+        self.m4[c] += (
+            m4
+            + d**4 * na * nb * (na**2 - na * nb + nb**2) / total**3
+            + 6 * d**2 * (na**2 * m2 + nb**2 * self.m2[c]) / total**2
+            + 4 * d * (na * m3 - nb * self.m3[c]) / total
+        )
+        self.m3[c] += m3 + d**3 * na * nb * (na - nb) / total**2 + 3 * d * (na * m2 - nb * self.m2[c]) / total
+        self.m2[c] += m2 + d**2 * na * nb / total
+        self.mean[c] += d * nb / total
+        self.count[c] += n
+
+    def update(self, traces: np.ndarray, classes: np.ndarray):
+        """Add traces to the accumulators
+
+        Args:
+            traces: array of traces, of shape (traces, samples)
+            classes: array of the class of each trace (FIXED or RANDOM), of shape (traces,)
+        """
+        for start in range(0, len(traces), CHUNK_SIZE):
+            chunk = traces[start : start + CHUNK_SIZE]
+            chunk_classes = np.asarray(classes[start : start + CHUNK_SIZE])
+            for c in (FIXED, RANDOM):
+                x = np.asarray(chunk[chunk_classes == c], dtype=np.float64)
+                if len(x):
+                    mean = x.mean(axis=0)
+                    centered = x - mean
+                    squares = centered**2
+                    m2 = squares.sum(axis=0)
+                    self._combine(c, len(x), mean, m2, (squares * centered).sum(axis=0), (squares**2).sum(axis=0))
+
+    def merge(self, other: "TVLA"):
+        """Add the accumulators of another assessment of the same samples
+
+        Args:
+            other: the other assessment
+        """
+        for c in (FIXED, RANDOM):
+            self._combine(c, other.count[c], other.mean[c], other.m2[c], other.m3[c], other.m4[c])
+
+    def t_statistic(self, order: int = 1) -> np.ndarray:
+        """Get Welch's t-statistic between the classes, for each sample
+
+        Args:
+            order: 1 to compare the means of the samples, 2 to compare their variances
+
+        Returns:
+            Array of t-statistics, of shape (samples,), zero while a class has less than 2 traces
+        """
+        if self.count.min() < 2:
+            return np.zeros(self.mean.shape[1])
+        n = self.count[:, None]
+        if order == 1:
+            mean, var = self.mean, self.m2 / n
+        elif order == 2:
+            mean, var = self.m2 / n, self.m4 / n - (self.m2 / n) ** 2
+        else:
+            raise ValueError(f"Invalid order: {order}")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = (mean[FIXED] - mean[RANDOM]) / np.sqrt(var[FIXED] / n[FIXED] + var[RANDOM] / n[RANDOM])
+        return np.nan_to_num(t, nan=0, posinf=0, neginf=0)
+
+    def max_t(self) -> tuple[float, float]:
+        """Get the maximum absolute t-statistics over the samples
+
+        Returns:
+            Tuple of (first order, second order) maximum absolute t-statistics
+        """
+        return float(np.abs(self.t_statistic(1)).max()), float(np.abs(self.t_statistic(2)).max())
+
+
+def parse_classes(lines: list[bytes]) -> np.ndarray:
+    """Parse the class of measures, from the information returned by the target board in fixed-vs-random mode
+    (the class follows the key, text and result, eg: ChipWhisperer)
+
+    Args:
+        lines: information of each measure
+
+    Returns:
+        int8 array of the class of each measure, of shape (traces,)
+    """
+    fields = [line.split() for line in lines]
+    if any(len(values) != 4 or values[3] not in (b"0", b"1") for values in fields):
+        raise ValueError("Invalid fixed-vs-random class")
+    return np.array([int(values[3]) for values in fields], dtype=np.int8)
+
+
+def save_tvla(out_directory: str, filename: str, tvla: TVLA, runs: int):
+    """Write the accumulators of the assessment of a point atomically
+
+    Args:
+        out_directory: output directory
+        filename: base name of the files of the point
+        tvla: the assessment
+        runs: number of runs of the point accumulated by the assessment, from its first run
+    """
+    path = os.path.join(out_directory, f"{filename}.{TVLA_EXT}")
+    with open(path + ".tmp", mode="wb") as f:
+        np.savez(f, runs=runs, count=tvla.count, mean=tvla.mean, m2=tvla.m2, m3=tvla.m3, m4=tvla.m4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def load_tvla(out_directory: str, filename: str, runs: int | None = None) -> TVLA:
+    """Load the accumulators of the assessment of a point
+
+    Args:
+        out_directory: output directory
+        filename: base name of the files of the point
+        runs: number of runs the accumulators must hold, eg: the runs of the point committed to the journal
+
+    Returns:
+        The assessment, or None if the point has not been assessed or its accumulators hold another number of runs
+    """
+    path = os.path.join(out_directory, f"{filename}.{TVLA_EXT}")
+    if not os.path.isfile(path):
+        return None
+    with np.load(path) as arrays:
+        if runs is not None and ("runs" not in arrays.files or int(arrays["runs"]) != runs):
+            return None
+        tvla = TVLA(arrays["mean"].shape[1])
+        tvla.count, tvla.mean, tvla.m2, tvla.m3, tvla.m4 = (arrays[key] for key in ("count", "mean", "m2", "m3", "m4"))
+    return tvla
+
+
+def tvla_chunk(
+    out_directory: str, filename: str, start: int = 0, stop: int | None = None, channel: str | None = None
+) -> TVLA:
+    """Assess a range of measures of a point stored by the acquisition, from their class in the information returned
+    by the target board, see run_analysis
+
+    Args:
+        out_directory: output directory
+        filename: base name of the files of the point
+        start, stop: range of the measures
+        channel: channel of the measures, for points acquired on several channels
+
+    Returns:
+        The assessment, with the accumulators of the range of measures
+    """
+    summary = read_summary(out_directory, filename)
+    measures = load_measures(out_directory, filename, summary, channel)
+    with open(os.path.join(out_directory, f"{filename}.info.txt"), mode="rb") as f:
+        classes = parse_classes([line.rstrip(b"\r\n") for line in itertools.islice(f, start, stop)])
+    stop = max(start, min(len(measures), start + len(classes)))
+    tvla = TVLA(measures.shape[1])
+    tvla.update(measures[start:stop], classes[: stop - start])
+    return tvla
+
+
+def tvla_point(out_directory: str, filename: str, stop: int | None = None) -> TVLA:
+    """Assess the measures of a point stored by the acquisition, see tvla_chunk()
+
+    Args:
+        out_directory: output directory
+        filename: base name of the files of the point
+        stop: number of measures to assess, every measure by default
+
+    Returns:
+        The assessment, with the accumulators of the measures of the first channel
+    """
+    return tvla_chunk(out_directory, filename, 0, stop)
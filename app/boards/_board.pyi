@@ -81,11 +81,14 @@ class Board:
         """Stop the algorithm"""
 
     @device_logger
-    def get(self) -> tuple[int, str]:
+    def get(self, binary: bool = False) -> tuple[int, str | bytes]:
         """Wait for the end of the algorithm, and return information about the encryption & the error count
 
+        Args:
+            binary: whether the information is returned as bytes (optional: key, text and result of 16 bytes each)
+
         Returns:
             Tuple of:
             - the number of errors that occurred during the algorithm
-            - information about the encryption as a string
+            - information about the encryption as a string, or as bytes
         """
@@ -1,5 +1,6 @@
 import chipwhisperer as cw
 import json
+import random
 from time import sleep
 
 from app.utils.logging import device_logger
@@ -8,7 +9,9 @@ from app.utils.logging import device_logger
 class Board:
     """
     Connect, disconnect and interact with a Chipwhisperer board running the SimpleSerial-AES firmware.
-    Key and text follow the NewAE's Basic Key Text Pattern
+    Key and text follow the NewAE's Basic Key Text Pattern. In fixed-vs-random mode, the key is fixed, the fixed text
+    of the pattern and random texts are interleaved according to a seeded schedule, and the class of each text
+    is returned
     """
 
     # Name of the board
@@ -21,6 +24,10 @@ class Board:
         self._platform = ""
         self._key, self._text = b"", b""
         self._ktp = cw.ktp.Basic()
+        self._tvla_seed = None
+        self._tvla_run = 0  # index of the next run drawn from the schedule
+        self._fixed_text = b""
+        self._class = None
 
     def _reset(self):
         """Reset the target board"""
@@ -47,6 +54,15 @@ class Board:
             self._scope.io.nrst = "high_z"
             sleep(0.05)
 
+    def _draw(self):
+        """Draw the class and the text of the next run from the fixed-vs-random schedule. Each run is drawn from its
+        own generator, seeded by the seed of the schedule and the index of the run, so that the schedule can be
+        resumed at any run"""
+        schedule = random.Random(f"{self._tvla_seed}:{self._tvla_run}")
+        self._class = schedule.getrandbits(1)
+        self._text = self._fixed_text if self._class == 0 else bytearray(schedule.randbytes(16))
+        self._tvla_run += 1
+
     def help(self) -> str:
         """Provide help for the target board
 
@@ -57,6 +73,9 @@ class Board:
             "Chipwhisperer SimpleSerial-AES target board\n"
             "Interact with the SimpleSerial-AES firmware\n"
             "Use NewAE's Basic Key Text Pattern\n"
+            "Set tvla_seed to interleave the fixed text and random texts with a fixed key (fixed-vs-random leakage "
+            "assessment)\n"
+            "Set tvla_run to resume the schedule at this run\n"
             "Address should specify PLATFORM and SimpleSerial version, separated by a semi-colon\n"
             "Example: CWLITEARM:SS_VER_1_1"
         )
@@ -123,6 +142,8 @@ class Board:
         settings = {
             "fixed_key": self._ktp.fixed_key,
             "fixed_text": self._ktp.fixed_text,
+            "tvla_seed": self._tvla_seed,
+            "tvla_run": self._tvla_run,
         }
         return json.dumps(settings, indent=4)
 
@@ -136,11 +157,20 @@ class Board:
         settings = json.loads(settings)
         self._ktp.fixed_key = settings["fixed_key"]
         self._ktp.fixed_text = settings["fixed_text"]
+        self._tvla_seed = settings.get("tvla_seed")
+        if self._tvla_seed is not None:
+            # The pattern keeps its key and fixed text, random texts are drawn from the schedule to be reproducible
+            self._ktp.fixed_key = True
+            self._ktp.fixed_text = True
+            self._fixed_text = self._ktp.next()[1]
+            self._tvla_run = settings.get("tvla_run", 0)
 
     @device_logger
     def run(self):
         """Run the encryption"""
         self._key, self._text = self._ktp.next()
+        if self._tvla_seed is not None:
+            self._draw()
         self._target.set_key(self._key)
         self._target.simpleserial_write("p", self._text)
 
@@ -149,12 +179,20 @@ class Board:
         """Unsupported by this board"""
 
     @device_logger
-    def get(self) -> tuple[int, str]:
+    def get(self, binary: bool = False) -> tuple[int, str | bytes]:
         """Wait for the end of the encryption. Returns the key & the text used, and the result of the encryption.
-        Does NOT count the number of failed encryption (returns 0)
+        Does NOT count the number of failed encryption (returns 0). In fixed-vs-random mode, the class of the text
+        follows (0: fixed, 1: random)
+
+        Args:
+            binary: whether the key, text and result are returned as 48 bytes instead of a string
 
         Returns:
-            The key & the text used, and the result of the encryption as string
+            The key & the text used, and the result of the encryption as string, or as bytes
         """
         data = self._target.simpleserial_read("r", 16)
+        if binary:
+            return 0, bytes(self._key) + bytes(self._text) + bytes(data)
+        if self._tvla_seed is not None:
+            return 0, f"{self._key.hex()} {self._text.hex()} {data.hex()} {self._class}"
         return 0, f"{self._key.hex()} {self._text.hex()} {data.hex()}"
@@ -131,13 +131,18 @@ class Board:
         """Unsupported by this board"""
 
     @device_logger
-    def get(self) -> tuple[int, str]:
+    def get(self, binary: bool = False) -> tuple[int, str]:
         """Wait for the end of the encryption, and get the number of failed encryption
 
+        Args:
+            binary: unsupported by this board, which does not return its key, text and result
+
         Returns:
             The number of errors that occurred during the algorithm, and an empty string
         """
         data = self._serial.read(2)
         while not data:
             data = self._serial.read(2)
+        if binary:
+            raise ValueError(f"{self.name} board does not return its key, text and result: labels are not supported")
         return struct.unpack("h", data)[0], ""
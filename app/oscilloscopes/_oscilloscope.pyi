@@ -159,9 +159,52 @@ class Oscilloscope:
         """
 
     @device_logger
-    def get_data(self) -> np.array:
+    def arm(self, averages: int = 1):
+        """Arm the oscilloscope for a single sequence acquisition
+
+        Args:
+            averages: number of acquisitions averaged by the oscilloscope into the waveform of the sequence
+        """
+
+    @device_logger
+    def wait(self) -> int:
+        """Wait for the end of the acquisition started by arm()
+
+        Returns:
+            Number of acquisitions done since arm(): 0 if the oscilloscope has not been triggered
+        """
+
+    @device_logger
+    def disarm(self):
+        """Go back to continuous acquisitions"""
+
+    @device_logger
+    def get_scaling(self, channel: str | None = None) -> tuple[float, float, float, float]:
+        """Get the scaling of the measured data
+
+        Args:
+            channel: the channel whose scaling must be retrieved, the waveform source by default
+
+        Returns:
+            Tuple of (y_mult, y_offset, y_zero, x_increment): a sample value v is (v - y_offset) * y_mult + y_zero
+            volts, and samples are x_increment seconds apart
+        """
+
+    @device_logger
+    def test_transfer(self) -> str:
+        """Measure the waveform transfer rate
+
+        Returns:
+            The result of the test, as a human readable string
+        """
+
+    @device_logger
+    def get_data(self, channels: list[str] | None = None) -> np.array:
         """Get measured data
 
+        Args:
+            channels: channels to read from the same acquisition, the waveform source only by default
+
         Returns:
-            A numpy array representing measured data
+            A numpy array representing measured data, of shape (channels, samples) if channels are given
         """
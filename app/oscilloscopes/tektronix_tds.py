@@ -1,6 +1,8 @@
 import pyvisa
 import numpy as np
 import json
+import socket
+import time
 
 from app.utils.logging import device_logger
 
@@ -16,11 +18,21 @@ class Oscilloscope:
     # Allowed channels
     channels = ["CH1", "CH2", "CH3", "CH4"]
 
-    def __init__(self, timeout=5000):
+    # Visa resource manager, reused across connections
+    _resource_manager = None
+
+    def __init__(self, timeout=5000, chunk_size=1024 * 1024, recv_buffer=4 * 1024 * 1024):
         """Initialize oscilloscope settings"""
 
         self._timeout = timeout
+        self._chunk_size = chunk_size
+        self._recv_buffer = recv_buffer
         self._is_open = False
+        self._raw_socket = False
+        self._width = 2
+        self._sequence = False
+        self._mode = None  # acquisition mode to restore after averaged acquisitions
+        self._cache = {}  # values of the settings as last queried, dropped when written
 
     def _query(self, command):
         """
@@ -34,6 +46,98 @@ class Oscilloscope:
         """
         self._oscilloscope.write(command)
 
+    def _query_batch(self, headers: list[str]) -> list[str]:
+        """
+        Query several settings in a single round trip, and cache their values
+        """
+        response = self._query(";:".join(f"{header}?" for header in headers))
+        values = [value.strip() for value in response.strip().split(";")]
+        if len(values) != len(headers):
+            raise ValueError(f"Unexpected response from the oscilloscope: {response}")
+        self._cache.update(zip(headers, values, strict=True))
+        return values
+
+    def _write_batch(self, settings: list[tuple[str, str]]):
+        """
+        Write several settings in a single command, skipping the settings whose queried value is unchanged.
+        The oscilloscope may coerce the written values, so they are queried again before being cached.
+        Out of sequence acquisitions, the settings may have been changed from the front panel: every setting
+        is written
+        """
+        if not self._sequence:
+            self._cache.clear()
+        settings = [(header, str(value)) for header, value in settings if not self._is_cached(header, value)]
+        if settings:
+            self._write(";:".join(f"{header} {value}" for header, value in settings))
+            for header, _ in settings:
+                self._cache.pop(header, None)
+
+    def _set_transfer(self, chunk_size, recv_buffer):
+        """
+        Set the size of the chunks read from the oscilloscope, and the receive buffer of raw sockets
+        """
+        self._chunk_size, self._recv_buffer = int(chunk_size), int(recv_buffer)
+        if not self._is_open:
+            return
+        self._oscilloscope.chunk_size = self._chunk_size
+
+        # pyvisa-py reads raw sockets by blocks of 4 kB by default
+        session = getattr(Oscilloscope._resource_manager.visalib, "sessions", {}).get(self._oscilloscope.session)
+        interface = getattr(session, "interface", None)
+        if isinstance(interface, socket.socket):
+            session.max_recv_size = self._chunk_size
+            interface.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self._recv_buffer)
+            interface.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _query_curve(self) -> np.array:
+        """
+        Query a waveform, as a binary block
+        """
+        if not self._raw_socket:
+            datatype = "b" if self._width == 1 else "h"
+            return self._oscilloscope.query_binary_values(
+                "CURVe?", datatype=datatype, is_big_endian=True, container=np.array
+            )
+
+        # On a raw socket, the block is read with its exact length, without looking for line feeds in the data
+        self._write("CURVe?")
+        self._oscilloscope.read_termination = ""
+        try:
+            header = self._oscilloscope.read_bytes(2)
+            length = int(self._oscilloscope.read_bytes(int(header[1:2])))
+            block = self._oscilloscope.read_bytes(length + 1)  # data and final line feed
+        finally:
+            self._oscilloscope.read_termination = "\n"
+        return np.frombuffer(block, dtype=f">i{self._width}", count=length // self._width)
+
+    def _source(self) -> str:
+        """
+        Get the channel whose waveform is transferred
+        """
+        if "DATa:SOUrce" in self._cache:
+            return self._cache["DATa:SOUrce"]
+        return self._query_batch(["DATa:SOUrce"])[0]
+
+    def _restore_mode(self):
+        """
+        Restore the acquisition mode which was set before averaged acquisitions
+        """
+        if self._mode is not None:
+            self._write_batch([("ACQuire:MODe", self._mode)])
+            self._mode = None
+
+    def _is_cached(self, header, value) -> bool:
+        """
+        Check if the last queried value of a setting is equal to a value
+        """
+        if header not in self._cache:
+            return False
+        cached, value = self._cache[header].upper(), str(value).strip().upper()
+        try:
+            return float(cached) == float(value)
+        except ValueError:
+            return cached == value
+
     def help(self) -> str:
         """Provide help for the oscilloscope
 
@@ -43,7 +147,8 @@ class Oscilloscope:
         return (
             "Tektronix TDS oscilloscope\n"
             "Address should be a valid visa resource name\n"
-            "Example: TCPIP::150.197.100.17::gpib0,1::INSTR"
+            "Example: TCPIP::150.197.100.17::gpib0,1::INSTR\n"
+            "Raw socket (faster transfers): TCPIP::150.197.100.17::4000::SOCKET"
         )
 
     @device_logger
@@ -53,14 +158,22 @@ class Oscilloscope:
         Args:
             addr: address of the oscilloscope
         """
-        rm = pyvisa.ResourceManager("@py")
-        self._oscilloscope = rm.open_resource(addr)
+        if Oscilloscope._resource_manager is None:
+            Oscilloscope._resource_manager = pyvisa.ResourceManager("@py")
+        self._oscilloscope = Oscilloscope._resource_manager.open_resource(addr)
         self._oscilloscope.timeout = self._timeout
+        self._raw_socket = addr.upper().endswith("::SOCKET")
+        if self._raw_socket:
+            # Raw sockets have no message framing: messages end with a line feed
+            self._oscilloscope.read_termination = "\n"
+            self._oscilloscope.write_termination = "\n"
         self._is_open = True
+        self._cache.clear()
+        self._set_transfer(self._chunk_size, self._recv_buffer)
 
-        # Enforce waveform transfer format
-        self._write("DATa:ENCdg RIBinary")
-        self._write("WFMOutpre:BYT_Nr 2")
+        # Enforce response format (values without headers) and waveform transfer format
+        self._write("HEADer OFF;:DATa:ENCdg RIBinary")
+        self._write_batch([("WFMOutpre:BYT_Nr", self._width)])
 
     @device_logger
     def disconnect(self):
@@ -84,6 +197,7 @@ class Oscilloscope:
         Args:
             cmd: custom command to send to the oscilloscope
         """
+        self._cache.clear()  # the command may change any setting
         self._oscilloscope.write(cmd)
 
     @device_logger
@@ -111,7 +225,7 @@ class Oscilloscope:
         if channel not in self.channels:
             raise ValueError
 
-        enabled = self._query(f"SELECT:{channel}?").strip()
+        (enabled,) = self._query_batch([f"SELECT:{channel}"])
         return bool(int(enabled.lower().split()[-1]))
 
     @device_logger
@@ -127,8 +241,7 @@ class Oscilloscope:
         if channel not in self.channels:
             raise ValueError
 
-        scale = self._query(f"{channel}:SCAle?").strip()
-        position = self._query(f"{channel}:POSition?").strip()
+        scale, position = self._query_batch([f"{channel}:SCAle", f"{channel}:POSition"])
 
         settings = {"scale": scale, "position": position}
         return json.dumps(settings, indent=4)
@@ -140,9 +253,9 @@ class Oscilloscope:
         Returns:
             The general settigns as a config string
         """
-        scale = self._query("HORizontal:SCAle?").strip()
-        position = self._query("HORizontal:POSition?").strip()
-        resolution = self._query("HORizontal:RESOlution?").strip()
+        scale, position, resolution = self._query_batch(
+            ["HORizontal:SCAle", "HORizontal:POSition", "HORizontal:RESOlution"]
+        )
 
         settings = {
             "horizontal": {
@@ -160,11 +273,15 @@ class Oscilloscope:
         Returns:
             The trigger settings as a config string
         """
-        source = self._query("TRIGger:A:EDGE:SOUrce?").strip()
-        coupling = self._query("TRIGger:A:EDGE:COUPling?").strip()
-        slop = self._query("TRIGger:A:EDGE:SLOpe?").strip()
-        level = self._query("TRIGger:A:LEVel?").strip()
-        mode = self._query("TRIGger:A:MODe?").strip()
+        source, coupling, slop, level, mode = self._query_batch(
+            [
+                "TRIGger:A:EDGE:SOUrce",
+                "TRIGger:A:EDGE:COUPling",
+                "TRIGger:A:EDGE:SLOpe",
+                "TRIGger:A:LEVel",
+                "TRIGger:A:MODe",
+            ]
+        )
 
         settings = {
             "source": source,
@@ -182,16 +299,19 @@ class Oscilloscope:
         Returns:
             The waveform settings as a config string
         """
-        source = self._query("DATa:SOUrce?").strip()
-        start = self._query("DATa:STARt?").strip()
-        stop = self._query("DATa:STOP?").strip()
-        mode = self._query("ACQuire:MODe?").strip()
+        source, start, stop, mode, width = self._query_batch(
+            ["DATa:SOUrce", "DATa:STARt", "DATa:STOP", "ACQuire:MODe", "WFMOutpre:BYT_Nr"]
+        )
+        self._width = int(width)
 
         settings = {
             "source": source,
             "start": start,
             "stop": stop,
             "mode": mode,
+            "width": self._width,
+            "chunk_size": self._chunk_size,
+            "recv_buffer": self._recv_buffer,
         }
         return json.dumps(settings, indent=4)
 
@@ -205,7 +325,7 @@ class Oscilloscope:
         if channel not in self.channels:
             raise ValueError
 
-        self._write(f"SELECT:{channel} ON")
+        self._write_batch([(f"SELECT:{channel}", "1")])
 
     @device_logger
     def disable_channel(self, channel: str):
@@ -217,7 +337,7 @@ class Oscilloscope:
         if channel not in self.channels:
             raise ValueError
 
-        self._write(f"SELECT:{channel} Off")
+        self._write_batch([(f"SELECT:{channel}", "0")])
 
     @device_logger
     def set_channel(self, channel: str, settings: str):
@@ -232,9 +352,13 @@ class Oscilloscope:
         if channel not in self.channels:
             raise ValueError
 
-        self._write(f"SELECT:{channel} ON")
-        self._write(f"{channel}:SCAle {settings['scale']}")
-        self._write(f"{channel}:POSition {settings['position']}")
+        self._write_batch(
+            [
+                (f"SELECT:{channel}", "1"),
+                (f"{channel}:SCAle", settings["scale"]),
+                (f"{channel}:POSition", settings["position"]),
+            ]
+        )
 
     @device_logger
     def set_general(self, settings: str):
@@ -245,9 +369,13 @@ class Oscilloscope:
         """
         settings = json.loads(settings)
 
-        self._write(f"HORizontal:SCAle {settings['horizontal']['scale']}")
-        self._write(f"HORizontal:POSition {settings['horizontal']['position']}")
-        self._write(f"HORizontal:RESOlution {settings['horizontal']['resolution']}")
+        self._write_batch(
+            [
+                ("HORizontal:SCAle", settings["horizontal"]["scale"]),
+                ("HORizontal:POSition", settings["horizontal"]["position"]),
+                ("HORizontal:RESOlution", settings["horizontal"]["resolution"]),
+            ]
+        )
 
     @device_logger
     def set_trigger(self, settings: str):
@@ -261,11 +389,15 @@ class Oscilloscope:
         if settings["source"] not in self.channels:
             raise ValueError
 
-        self._write(f"TRIGger:A:EDGE:SOUrce {settings['source']}")
-        self._write(f"TRIGger:A:EDGE:COUPling {settings['coupling']}")
-        self._write(f"TRIGger:A:EDGE:SLOpe {settings['slop']}")
-        self._write(f"TRIGger:A:LEVel {settings['level']}")
-        self._write(f"TRIGger:A:MODe {settings['mode']}")
+        self._write_batch(
+            [
+                ("TRIGger:A:EDGE:SOUrce", settings["source"]),
+                ("TRIGger:A:EDGE:COUPling", settings["coupling"]),
+                ("TRIGger:A:EDGE:SLOpe", settings["slop"]),
+                ("TRIGger:A:LEVel", settings["level"]),
+                ("TRIGger:A:MODe", settings["mode"]),
+            ]
+        )
 
     @device_logger
     def set_waveform(self, settings: str):
@@ -278,18 +410,132 @@ class Oscilloscope:
 
         if settings["source"] not in self.channels:
             raise ValueError
+        if settings.get("width", self._width) not in (1, 2):
+            raise ValueError("Width should be 1 or 2 bytes per sample")
+
+        self._width = settings.get("width", self._width)
+        self._mode = None
+        self._write_batch(
+            [
+                ("DATa:SOUrce", settings["source"]),
+                ("DATa:STARt", settings["start"]),
+                ("DATa:STOP", settings["stop"]),
+                ("ACQuire:MODe", settings["mode"]),
+                ("WFMOutpre:BYT_Nr", self._width),
+            ]
+        )
+        self._set_transfer(
+            settings.get("chunk_size", self._chunk_size),
+            settings.get("recv_buffer", self._recv_buffer),
+        )
+
+    @device_logger
+    def arm(self, averages: int = 1):
+        """Arm the oscilloscope for a single sequence acquisition
+
+        Args:
+            averages: number of acquisitions averaged by the oscilloscope into the waveform of the sequence
+        """
+        if averages > 1:
+            if self._mode is None:
+                (self._mode,) = self._query_batch(["ACQuire:MODe"])
+            self._write_batch([("ACQuire:MODe", "AVErage"), ("ACQuire:NUMAVg", averages)])
+        else:
+            self._restore_mode()
+        self._write("ACQuire:STOPAfter SEQuence;:ACQuire:STATE RUN")
+        self._sequence = True
+
+    @device_logger
+    def wait(self) -> int:
+        """Wait for the end of the acquisition started by arm()
+
+        Returns:
+            Number of acquisitions done since arm(): 0 if the oscilloscope has not been triggered
+        """
+        try:
+            _, count = self._query("*OPC?;:ACQuire:NUMACq?").strip().split(";")
+            return int(count.split()[-1])
+        except pyvisa.errors.VisaIOError:
+            # *OPC? timed out: clear the pending query so that its answer does not come with the next one
+            self._oscilloscope.clear()
+            return 0
 
-        self._write(f"DATa:SOUrce {settings['source']}")
-        self._write(f"DATa:STARt {settings['start']}")
-        self._write(f"DATa:STOP {settings['stop']}")
-        self._write(f"ACQuire:MODe {settings['mode']}")
+    @device_logger
+    def disarm(self):
+        """Go back to continuous acquisitions"""
+        self._restore_mode()
+        self._write("ACQuire:STOPAfter RUNSTop;:ACQuire:STATE RUN")
+        self._sequence = False
+        self._cache.clear()  # settings may then be changed from the front panel
 
     @device_logger
-    def get_data(self) -> np.array:
+    def get_scaling(self, channel: str | None = None) -> tuple[float, float, float, float]:
+        """Get the scaling of the measured data
+
+        Args:
+            channel: the channel whose scaling must be retrieved, the waveform source by default
+
+        Returns:
+            Tuple of (y_mult, y_offset, y_zero, x_increment): a sample value v is (v - y_offset) * y_mult + y_zero
+            volts, and samples are x_increment seconds apart
+        """
+        headers = ["WFMOutpre:YMUlt", "WFMOutpre:YOFf", "WFMOutpre:YZEro", "WFMOutpre:XINcr"]
+        if channel is None:
+            values = self._query_batch(headers)
+        else:
+            if channel not in self.channels:
+                raise ValueError
+            source = self._source()
+            self._write_batch([("DATa:SOUrce", channel)])
+            values = self._query_batch(headers)
+            self._write_batch([("DATa:SOUrce", source)])
+        return tuple(float(value) for value in values)
+
+    @device_logger
+    def test_transfer(self, n=20) -> str:
+        """Measure the waveform transfer rate
+
+        Args:
+            n: number of waveforms to transfer
+
+        Returns:
+            The result of the test, as a human readable string
+        """
+        start = time.perf_counter()
+        size = sum(len(self.get_data()) for _ in range(n))
+        duration = time.perf_counter() - start
+        return (
+            f"{n} waveforms of {size // n} samples transferred in {duration:.3f} s\n"
+            f"{n / duration:.1f} waveforms/s, {self._width * size / duration / 1e6:.2f} MB/s\n"
+            f"Resource: {self._oscilloscope.resource_name}, chunk size: {self._chunk_size} bytes"
+        )
+
+    @device_logger
+    def get_data(self, channels: list[str] | None = None) -> np.array:
         """Get measured data
 
+        Args:
+            channels: channels to read from the same acquisition, the waveform source only by default
+
         Returns:
-            A numpy array representing measured data
+            A numpy array representing measured data, of shape (channels, samples) if channels are given
         """
-        data = self._oscilloscope.query_binary_values("CURVe?", datatype="h", is_big_endian=True)
-        return np.array(data)
+        if channels is None:
+            return self._query_curve()
+        if any(channel not in self.channels for channel in channels):
+            raise ValueError
+
+        # Outside of sequence acquisitions, acquisitions are stopped so that every channel comes from the same one
+        source = self._source()
+        if not self._sequence:
+            self._write("ACQuire:STATE STOP")
+        try:
+            data = []
+            for channel in channels:
+                self._write_batch([("DATa:SOUrce", channel)])
+                data.append(self._query_curve())
+        finally:
+            self._write_batch([("DATa:SOUrce", source)])
+            if not self._sequence:
+                self._write("ACQuire:STATE RUN")
+        return np.stack(data)
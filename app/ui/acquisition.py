@@ -1,16 +1,40 @@
-from PySide6.QtWidgets import QApplication, QMessageBox, QFileDialog
+import json
+
+from PySide6.QtCore import QObject, Qt, Signal
+from PySide6.QtWidgets import QApplication, QMessageBox, QFileDialog, QTableWidgetItem
 
 from app.utils.acquisition import (
+    DEFAULT_SETTINGS,
     parse_out_directory,
+    parse_settings,
     run_acquisition,
     run_target_board,
     stop_acquisition,
     stop_target_board,
 )
+from app.utils.campaign import create_campaign, point_files, resume_campaign
 from app.utils.devices import get_available_devices
-from app.utils.drawing import display_data, hide_data
+from app.utils.drawing import display_cells, display_data, hide_data
 from app.utils.logging import handle
-from app.utils.positioning import img_point, real_point, xy_by_box_number
+from app.utils.positioning import dist, img_point, real_point, xy_by_box_number
+from app.utils.quadtree import (
+    cell_center,
+    cell_polygon,
+    create_quadtree,
+    leaves,
+    load_quadtree,
+    quadtree_points,
+    remove_quadtree,
+)
+
+
+class AcquisitionSignals(QObject):
+    """Signals emitted from the acquisition thread"""
+
+    progress = Signal(object, object, object)  # current, max, (x,y): counts may not fit in a 32-bit int
+    cpa = Signal(object, object, object)  # (x,y), best key guess, key rank
+    tvla = Signal(object, object, object)  # (x,y), first order max |t|, second order max |t|
+    error = Signal(object)  # error message of the stopped acquisition
 
 
 class AcquisitionUi:
@@ -21,7 +45,12 @@ class AcquisitionUi:
         self.out_directory = ""
         self.board_thread = None
         self.acquisition_thread = None
+        self.acquisition_point = None
         self.displayed_data = []
+        self.tvla_threshold = None
+        self.signals = AcquisitionSignals()
+
+        self.ui.acquisitionSettingsTextEdit.setPlainText(json.dumps(DEFAULT_SETTINGS, indent=4))
 
         # Get available devices
         self.board_devices = get_available_devices("boards")
@@ -42,9 +71,15 @@ class AcquisitionUi:
 
         self.ui.displayDataGroupBox.toggled.connect(self.on_displayDataGroupBox_change)
         self.ui.displayActivityRadioButton.toggled.connect(self.on_displayActivityRadioButton_change)
+        self.ui.displaySnrRadioButton.toggled.connect(self.on_displaySnrRadioButton_change)
+        self.ui.displayBandRadioButton.toggled.connect(self.on_displayBandRadioButton_change)
         self.ui.displayErrorRadioButton.toggled.connect(self.on_displayErrorRadioButton_change)
 
         self.ui.acquisitionRunButton.clicked.connect(self.on_acquisitionRunButton_click)
+        self.signals.progress.connect(self.acquisition_refresher, Qt.QueuedConnection)
+        self.signals.cpa.connect(self.cpa_refresher, Qt.QueuedConnection)
+        self.signals.tvla.connect(self.tvla_refresher, Qt.QueuedConnection)
+        self.signals.error.connect(self.acquisition_error, Qt.QueuedConnection)
 
     def on_boardDeviceComboBox_change(self, i):
         self.devices.board = self.board_devices[i]()
@@ -146,6 +181,12 @@ class AcquisitionUi:
     def on_displayActivityRadioButton_change(self, checked):
         self.update_displayed_data()
 
+    def on_displaySnrRadioButton_change(self, checked):
+        self.update_displayed_data()
+
+    def on_displayBandRadioButton_change(self, checked):
+        self.update_displayed_data()
+
     def on_displayErrorRadioButton_change(self, checked):
         self.update_displayed_data()
 
@@ -163,38 +204,80 @@ class AcquisitionUi:
             if not self.out_directory:
                 raise Exception("Output directory must be selected before acquisition")
 
-            points = []
-            if self.ui.mapAreaCheckBox.isChecked():
-                if self.devices.img is None or not self.devices.grid:
-                    raise Exception("Area of interest must be defined on a photo first")
-                n = self.ui.acquisitionAreaNSpinBox.value()
-                h, w = self.devices.img.height(), self.devices.img.width()
-                for i in range(n**2):
-                    x, y = xy_by_box_number(i, n, self.devices.grid)
-                    x_real, y_real = real_point(
-                        x,
-                        y,
-                        w,
-                        h,
-                        self.devices.positioning.X_BOUNDS,
-                        self.devices.positioning.Y_BOUNDS,
-                        self.ui.positioningXOffsetSpinBox.value(),
-                        self.ui.positioningYOffsetSpinBox.value(),
-                    )
-                    points.append((x_real, y_real))
+            completed = {}
+            if self.ui.resumeCheckBox.isChecked():
+                points, runs_per_measure, settings, completed = resume_campaign(self.out_directory)
+                settings = parse_settings(json.dumps(settings))
+                if settings["refine"] is not None:
+                    points = quadtree_points(self.out_directory)  # points added by the last refinement included
+                elif sum(completed.values()) >= len(points) * runs_per_measure:
+                    raise Exception("The acquisition of the output directory is already complete")
             else:
-                x, y, _ = self.devices.positioning.locate()
-                points.append((x, y))
+                points = []
+                settings = parse_settings(self.ui.acquisitionSettingsTextEdit.toPlainText())
+                files = point_files(self.out_directory)
+                if files:
+                    QApplication.restoreOverrideCursor()
+                    alertmsg = (
+                        f"The output directory holds {len(files)} files of a previous acquisition, which will be "
+                        "deleted by the new acquisition. Please select another directory or check Resume to keep them."
+                    )
+                    ret = QMessageBox(
+                        QMessageBox.Warning,
+                        "Acquisition run",
+                        alertmsg,
+                        QMessageBox.Ok | QMessageBox.Cancel,
+                    ).exec()
+                    QApplication.setOverrideCursor(Qt.WaitCursor)
+                    if ret != QMessageBox.Ok:
+                        return
+                if self.ui.mapAreaCheckBox.isChecked():
+                    if self.devices.img is None or not self.devices.grid:
+                        raise Exception("Area of interest must be defined on a photo first")
+                    n = self.ui.acquisitionAreaNSpinBox.value()
+                    h, w = self.devices.img.height(), self.devices.img.width()
+
+                    def real(x, y):
+                        return real_point(
+                            x,
+                            y,
+                            w,
+                            h,
+                            self.devices.positioning.X_BOUNDS,
+                            self.devices.positioning.Y_BOUNDS,
+                            self.ui.positioningXOffsetSpinBox.value(),
+                            self.ui.positioningYOffsetSpinBox.value(),
+                        )
+
+                    if settings["refine"] is not None:
+                        points = create_quadtree(self.out_directory, [real(*p) for p in self.devices.grid], n)
+                    else:
+                        for i in range(n**2):
+                            points.append(real(*xy_by_box_number(i, n, self.devices.grid)))
+                elif settings["refine"] is not None:
+                    raise Exception("Area of interest must be mapped to be refined")
+                else:
+                    x, y, _ = self.devices.positioning.locate()
+                    points.append((x, y))
+
+                if settings["refine"] is None:
+                    remove_quadtree(self.out_directory)
+                runs_per_measure = self.ui.acquisitionCountSpinBox.value()
+                create_campaign(self.out_directory, points, runs_per_measure, settings)
 
-            runs_per_measure = self.ui.acquisitionCountSpinBox.value()
             self.acquisition_thread = run_acquisition(
                 self.devices.board,
                 self.devices.oscilloscope,
                 self.devices.positioning,
-                self.acquisition_refresher,
+                self.signals.progress.emit,
                 points,
                 runs_per_measure,
                 self.out_directory,
+                settings,
+                completed,
+                self.signals.cpa.emit,
+                self.signals.tvla.emit,
+                self.signals.error.emit,
             )
             self.ui.targetBoardBox.setEnabled(False)
             self.ui.acquisitionGroupBox.setEnabled(False)
@@ -215,6 +298,12 @@ class AcquisitionUi:
                     button.click()
             self.ui.positioningToolsWidget.setEnabled(False)
             self.ui.acquisitionProgressBar.setEnabled(True)
+            self.ui.cpaTableWidget.clearContents()
+            self.ui.cpaTableWidget.setEnabled(settings["cpa"])
+            self.ui.tvlaLabel.setText("Leakage assessment: -")
+            self.ui.tvlaLabel.setEnabled(settings["tvla"] is not None)
+            self.tvla_threshold = settings["tvla"]["threshold"] if settings["tvla"] is not None else None
+            self.acquisition_point = None
             self.ui.acquisitionRunButton.setText("Stop acquisition")
 
         else:
@@ -235,19 +324,42 @@ class AcquisitionUi:
             self.update_displayed_data()
 
     def acquisition_refresher(self, current, max, point):
+        if self.acquisition_thread is None:  # progress queued before the acquisition has been stopped
+            return
+
         progress = int(current / max * 100)
         self.ui.acquisitionProgressBar.setValue(progress)
 
-        x, y = point
-        self.ui.positioningMoveWidget.setEnabled(True)
-        self.ui.positioningXCoordSpinBox.setValue(x - self.ui.positioningXOffsetSpinBox.value())
-        self.ui.positioningYCoordSpinBox.setValue(y - self.ui.positioningYOffsetSpinBox.value())
-        self.ui.positioningRefreshButton.click()
-        self.ui.positioningMoveWidget.setEnabled(False)
+        if point != self.acquisition_point:
+            self.acquisition_point = point
+            x, y = point
+            self.ui.positioningMoveWidget.setEnabled(True)
+            self.ui.positioningXCoordSpinBox.setValue(x - self.ui.positioningXOffsetSpinBox.value())
+            self.ui.positioningYCoordSpinBox.setValue(y - self.ui.positioningYOffsetSpinBox.value())
+            self.ui.positioningRefreshButton.click()
+            self.ui.positioningMoveWidget.setEnabled(False)
 
         if current == max:
             self.ui.acquisitionRunButton.click()
 
+    def acquisition_error(self, message):
+        if self.acquisition_thread is not None:
+            self.ui.acquisitionRunButton.click()
+        QMessageBox(QMessageBox.Critical, "Acquisition", f"Error: {message}").exec()
+
+    def cpa_refresher(self, point, best_guess, key_rank):
+        self.ui.cpaTableWidget.setToolTip(f"Live correlation power analysis of the point ({point[0]:g}, {point[1]:g})")
+        for i, (guess, rank) in enumerate(zip(best_guess, key_rank, strict=True)):
+            self.ui.cpaTableWidget.setItem(0, i, QTableWidgetItem(f"{guess:02x}"))
+            self.ui.cpaTableWidget.setItem(1, i, QTableWidgetItem(str(rank)))
+
+    def tvla_refresher(self, point, t1, t2):
+        leaking = "leakage detected" if max(t1, t2) > self.tvla_threshold else "no leakage detected"
+        self.ui.tvlaLabel.setText(
+            f"Leakage assessment of ({point[0]:g}, {point[1]:g}): "
+            f"max |t| = {t1:.2f} (1st order), {t2:.2f} (2nd order), {leaking}"
+        )
+
     @handle("Update displayed data")
     def update_displayed_data(self):
         if not self.out_directory or self.devices.img is None or self.devices.positioning is None:
@@ -256,11 +368,22 @@ class AcquisitionUi:
         hide_data(self.ui.cameraDisplay.scene(), self.displayed_data)
 
         if self.ui.displayDataGroupBox.isChecked():
-            data = parse_out_directory(self.out_directory, errors_data=self.ui.displayErrorRadioButton.isChecked())
-            data_img = {}
-            for x_real, y_real in data.keys():
-                h, w = self.devices.img.height(), self.devices.img.width()
-                x_img, y_img = img_point(
+            if self.ui.displayErrorRadioButton.isChecked():
+                metric = "errors"
+            elif self.ui.displaySnrRadioButton.isChecked():
+                metric = "snr"
+            elif self.ui.displayBandRadioButton.isChecked():
+                metric = "band"
+            else:
+                metric = "activity"
+            band = parse_settings(self.ui.acquisitionSettingsTextEdit.toPlainText())["band"]
+            if metric == "band" and band is None:
+                raise Exception("A band must be set in the acquisition settings to display the band power")
+            data = parse_out_directory(self.out_directory, metric, band)
+            h, w = self.devices.img.height(), self.devices.img.width()
+
+            def img(x_real, y_real):
+                return img_point(
                     x_real,
                     y_real,
                     w,
@@ -270,5 +393,18 @@ class AcquisitionUi:
                     self.ui.positioningXOffsetSpinBox.value(),
                     self.ui.positioningYOffsetSpinBox.value(),
                 )
-                data_img[(x_img, y_img)] = data[(x_real, y_real)]
+
+            quadtree = load_quadtree(self.out_directory)
+            if quadtree is not None and data:
+                # Each cell of a refined area takes the value of the measured point closest to its center
+                corners, cells = quadtree
+                cells_img, values = [], []
+                for cell in leaves(cells):
+                    center = cell_center(corners, cell)
+                    cells_img.append([img(*point) for point in cell_polygon(corners, cell)])
+                    values.append(data[min(data, key=lambda point: dist(point, center))])
+                display_cells(self.ui.cameraDisplay.scene(), cells_img, values, self.displayed_data)
+                return
+
+            data_img = {img(x_real, y_real): value for (x_real, y_real), value in data.items()}
             display_data(self.ui.cameraDisplay.scene(), data_img, self.displayed_data)
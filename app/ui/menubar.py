@@ -131,6 +131,9 @@ class MenubarUi:
             self.devices.board.set_settings(config["board"]["settings"])
             self.ui.boardSettingsGetButton.click()
 
+        if "acquisition" in config:
+            self.ui.acquisitionSettingsTextEdit.setPlainText(config["acquisition"]["settings"])
+
     @handle("Save settings")
     def on_actionSave_click(self):
         config = {}
@@ -168,6 +171,8 @@ class MenubarUi:
             config["board"] = {"name": self.devices.board.name, "address": self.ui.boardAddressLineEdit.text()}
             config["board"]["settings"] = self.devices.board.get_settings()
 
+        config["acquisition"] = {"settings": self.ui.acquisitionSettingsTextEdit.toPlainText()}
+
         QApplication.restoreOverrideCursor()
         filename, _ = QFileDialog().getSaveFileName(dir="configs", filter="JSON config file (*.json)")
         QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
@@ -28,6 +28,7 @@ class OscilloscopeUi:
         self.ui.oscilloscopeSettingsComboBox.currentIndexChanged.connect(self.on_oscilloscopeSettingsComboBox_change)
         self.ui.oscilloscopeSettingsGetButton.clicked.connect(self.on_oscilloscopeSettingsGetButton_click)
         self.ui.oscilloscopeSettingsApplyButton.clicked.connect(self.on_oscilloscopeSettingsApplyButton_click)
+        self.ui.oscilloscopeTransferTestButton.clicked.connect(self.on_oscilloscopeTransferTestButton_click)
 
         self.ui.oscilloscopeCmdLineEdit.returnPressed.connect(self.on_oscilloscopeCmdLineEdit_enter)
 
@@ -122,6 +123,12 @@ class OscilloscopeUi:
         elif settings_type == 2:
             settings = self.devices.oscilloscope.set_waveform(settings)
 
+    @handle("Oscilloscope transfer test")
+    def on_oscilloscopeTransferTestButton_click(self):
+        result = self.devices.oscilloscope.test_transfer()
+        QApplication.restoreOverrideCursor()
+        QMessageBox(QMessageBox.Information, "Oscilloscope transfer test", result).exec()
+
     @handle("Oscilloscope raw command")
     def on_oscilloscopeCmdLineEdit_enter(self):
         self.devices.oscilloscope.send(self.ui.oscilloscopeCmdLineEdit.text())
@@ -1,6 +1,187 @@
+import contextlib
+import json
+import multiprocessing
 import numpy as np
 import os
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.analysis.activity import activity_chunk
+from app.analysis.cpa import CPA
+from app.analysis.faults import fault_rate_map
+from app.analysis.snr import snr_point
+from app.analysis.spectrum import band_power_map, band_power_point
+from app.analysis.tvla import DEFAULT_TVLA_SETTINGS, TVLA, load_tvla, parse_classes, save_tvla, tvla_point
+from app.utils.alignment import Aligner, load_reference, parse_alignment, save_reference
+from app.utils.campaign import SYNC_INTERVAL, Journal, extend_campaign, read_journal
+from app.utils.convergence import DEFAULT_ADAPTIVE_SETTINGS, METRICS, Convergence
+from app.utils.logging import log
+from app.utils.pipeline import parse_pipeline, process
+from app.utils.poi import DEFAULT_POI_SETTINGS, crop, load_windows, save_windows, select_windows
+from app.utils.quality import QualityFilter, parse_quality, remove_counters, save_counters
+from app.utils.quadtree import DEFAULT_REFINE_SETTINGS, refine_quadtree
+from app.utils.ring_buffer import BLOCK, DROP, Consumer, RingBuffer
+from app.utils.storage import (
+    LABEL_SIZE,
+    label_width,
+    labels_file,
+    list_points,
+    load_errors,
+    measures_file,
+    pack_errors,
+    parse_info,
+    point_coords,
+    point_filename,
+    read_summary,
+    write_summary,
+)
+
+# Size of the shared memory used to transfer measures to the writer process, in bytes
+RING_SIZE = 64 * 1024 * 1024
+
+# Maximum size of the information returned by the target board for one measure, in bytes
+INFO_SIZE = 256
+
+# Default acquisition settings
+DEFAULT_SETTINGS = {
+    "refresh_rate": 10,  # maximum number of ui refreshes per second
+    # "continuous", "sequence" to arm the oscilloscope before each run, or "average" to store only the waveform
+    # averaged by the oscilloscope over the runs of each point
+    "capture": "continuous",
+    "poi": None,  # settings of the point of interest selection, see DEFAULT_POI_SETTINGS ({} for default values)
+    "autorange": None,  # settings of the vertical auto-ranging at each point, see DEFAULT_AUTORANGE_SETTINGS
+    "channels": None,  # channels read from each acquisition, eg: ["CH1", "CH2"] (the waveform source only by default)
+    "adaptive": None,  # settings of the early stopping of the runs of a point, see DEFAULT_ADAPTIVE_SETTINGS
+    "refine": None,  # settings of the coarse-to-fine refinement of the area of interest, see DEFAULT_REFINE_SETTINGS
+    "cpa": False,  # live correlation power analysis of each point, from the key and plaintext returned by the board
+    "tvla": None,  # settings of the live fixed-vs-random leakage assessment of each point, see DEFAULT_TVLA_SETTINGS
+    "band": None,  # [low, high] frequency band of the band power metric of the points, in Hz
+    "pipeline": None,  # settings of the pre-processing of the stored measures, see DEFAULT_PIPELINE_SETTINGS
+    "align": None,  # settings of the alignment of the traces on a reference pattern, see DEFAULT_ALIGN_SETTINGS
+    "quality": None,  # settings of the rejection and re-acquisition of invalid traces, see DEFAULT_QUALITY_SETTINGS
+    # settings of the storage of the key, text and result returned by the target board as binary labels instead of
+    # information strings, for boards whose get() supports binary=True, see DEFAULT_LABELS_SETTINGS
+    "labels": None,
+}
+
+# Minimum delay between two refreshes of the live correlation power analysis, in seconds
+CPA_REFRESH_INTERVAL = 1.0
+
+# Minimum delay between two refreshes of the live leakage assessment, in seconds
+TVLA_REFRESH_INTERVAL = 1.0
+
+# Default settings of the vertical auto-ranging
+DEFAULT_AUTORANGE_SETTINGS = {
+    "pilot_traces": 5,  # number of traces measured to set the vertical scale
+    "target": 0.8,  # peak of the traces, relative to the full range of the samples
+    "iterations": 4,  # maximum number of scale adjustments
+}
+
+# Default settings of the binary labels
+DEFAULT_LABELS_SETTINGS = {
+    "fixed_key": True,  # whether the key is the same for every measure of a point, stored once in its summary
+}
+
+# Fraction of the full range from which traces are considered as clipped
+CLIP_LEVEL = 0.98
+
+# Maximum number of consecutive missed triggers in sequence and average capture
+MAX_MISSED_TRIGGERS = 3
+
+# Maximum number of consecutive traces rejected by the alignment
+MAX_MISALIGNED_TRACES = 10
+
+
+def _merge_settings(name: str, settings: dict, defaults: dict) -> dict:
+    """Use default values for missing nested settings, and reject unknown settings"""
+    for key in settings:
+        if key not in defaults:
+            raise ValueError(f"Unknown {name} setting: {key}")
+    return {**defaults, **settings}
+
+
+def parse_settings(settings: str) -> dict:
+    """Parse acquisition settings, using default values for missing settings
+
+    Args:
+        settings: the acquisition settings as a config string
+
+    Returns:
+        Dict of acquisition settings
+    """
+    settings = json.loads(settings) if settings.strip() else {}
+    for key in settings:
+        if key not in DEFAULT_SETTINGS:
+            raise ValueError(f"Unknown acquisition setting: {key}")
+    settings = {**DEFAULT_SETTINGS, **settings}
+    if settings["capture"] not in ("continuous", "sequence", "average"):
+        raise ValueError(f"Invalid capture: {settings['capture']}")
+    if settings["poi"] is not None:
+        settings["poi"] = _merge_settings("points of interest", settings["poi"], DEFAULT_POI_SETTINGS)
+    if settings["autorange"] is not None:
+        settings["autorange"] = _merge_settings("autorange", settings["autorange"], DEFAULT_AUTORANGE_SETTINGS)
+    if settings["channels"] is not None and (
+        not settings["channels"] or len(set(settings["channels"])) != len(settings["channels"])
+    ):
+        raise ValueError(f"Invalid channels: {settings['channels']}")
+    if settings["adaptive"] is not None:
+        if settings["capture"] == "average":
+            raise ValueError("Adaptive runs are not available in average capture")
+        settings["adaptive"] = _merge_settings("adaptive", settings["adaptive"], DEFAULT_ADAPTIVE_SETTINGS)
+    if not isinstance(settings["cpa"], bool):
+        raise ValueError(f"Invalid cpa: {settings['cpa']}")
+    if settings["cpa"] and settings["capture"] == "average":
+        raise ValueError("Live CPA is not available in average capture")
+    if settings["refine"] is not None:
+        settings["refine"] = _merge_settings("refinement", settings["refine"], DEFAULT_REFINE_SETTINGS)
+        if settings["refine"]["metric"] not in (*METRICS, "band"):
+            raise ValueError(f"Invalid refinement metric: {settings['refine']['metric']}")
+        if settings["refine"]["metric"] == "band" and settings["band"] is None:
+            raise ValueError("Refinement on the band power requires a band")
+    if settings["band"] is not None and (
+        len(settings["band"]) != 2 or not 0 <= settings["band"][0] < settings["band"][1]
+    ):
+        raise ValueError(f"Invalid band: {settings['band']}")
+    if settings["pipeline"] is not None:
+        settings["pipeline"] = parse_pipeline(settings["pipeline"])
+    if settings["align"] is not None:
+        if settings["capture"] == "average":
+            raise ValueError("Alignment is not available in average capture")
+        settings["align"] = parse_alignment(settings["align"])
+    if settings["quality"] is not None:
+        if settings["capture"] == "average":
+            raise ValueError("Quality filter is not available in average capture")
+        settings["quality"] = parse_quality(settings["quality"])
+    if settings["tvla"] is not None:
+        if settings["capture"] == "average":
+            raise ValueError("Leakage assessment is not available in average capture")
+        settings["tvla"] = _merge_settings("leakage assessment", settings["tvla"], DEFAULT_TVLA_SETTINGS)
+    if settings["labels"] is not None:
+        if settings["tvla"] is not None:
+            raise ValueError(
+                "Leakage assessment needs the fixed-vs-random class of the information strings, not binary labels"
+            )
+        settings["labels"] = _merge_settings("labels", settings["labels"], DEFAULT_LABELS_SETTINGS)
+    return settings
+
+
+class _Throttle:
+    """Limit the rate of the calls to a ui refresher. Calls are always forwarded when the point changes
+    or when the acquisition ends, and are otherwise dropped if they come too fast"""
+
+    def __init__(self, ui_refresher, rate):
+        self._ui_refresher = ui_refresher
+        self._interval = 1 / rate if rate > 0 else 0
+        self._last_call = -float("inf")
+        self._point = None
+
+    def __call__(self, current, max, point):
+        now = time.monotonic()
+        if point != self._point or current == max or now - self._last_call >= self._interval:
+            self._last_call = now
+            self._point = point
+            self._ui_refresher(current, max, point)
 
 
 def _run_target_board_thread(board, stop_refresh, abort_on_error, stop_event, results):
@@ -52,6 +233,503 @@ def stop_target_board(board, thread, stop_event, results):
     return results[0]
 
 
+def _frame_dtype(data: np.ndarray) -> np.dtype:
+    """Get the dtype of the ring buffer frames used to transfer measures to the writer process"""
+    return np.dtype(
+        [
+            ("point", np.int64),
+            ("run", np.int64),
+            ("x", np.float64),
+            ("y", np.float64),
+            ("errors", np.int64),
+            ("info", f"S{INFO_SIZE}"),
+            ("labels", np.uint8, (LABEL_SIZE,)),
+            ("scaling", np.float64, (*data.shape[:-1], 4)),
+            ("range", np.float64, data.shape[:-1]),
+            ("last", np.bool_),
+            ("data", data.dtype, data.shape),
+        ]
+    )
+
+
+def _run_writer_process(spec, consumer, out_directory, settings, runs_per_measure):
+    """Writer process: store the measures published in the ring buffer, and record them in the journal.
+    Measures of each channel are stored in their own file, or in the summary of the point in average capture.
+    Measures are not stored when the leakage assessment only keeps its accumulators. The stages of the pipeline
+    are applied to each batch of measures read from the ring buffer, split between the threads of a pool.
+    Binary labels are stored instead of the information strings when enabled, without the key if it is fixed.
+    The error counts of the runs are packed in the summary of the point, saved before each journal synchronization.
+    If the acquisition process dies without closing the ring buffer, the published measures are stored, then
+    the writer destroys the shared memory and exits"""
+    channels = settings["channels"]
+    labels = settings["labels"]
+    average = settings["capture"] == "average"
+    store = settings["tvla"] is None or settings["tvla"]["store"]
+    pipeline = settings["pipeline"]
+    executor = ThreadPoolExecutor(max_workers=pipeline["workers"]) if pipeline is not None else None
+    ring = RingBuffer.attach(spec)
+    reader = Consumer(ring, consumer)
+    parent = multiprocessing.parent_process()
+    orphaned = False
+    files, point, filename, summary, errors = [], None, None, None, []
+
+    def save_summary():
+        if point is not None:
+            write_summary(out_directory, filename, **summary, **pack_errors(errors))
+
+    journal = Journal(out_directory, save_summary)
+    frames = frame = batch = scaling = data = frame_scaling = None
+    with contextlib.ExitStack() as point_files:  # files of the current point
+        try:
+            while not reader.finished() and not orphaned:
+                frames = reader.peek(timeout=SYNC_INTERVAL)
+                batch, scaling = frames["data"], frames["scaling"]
+                if pipeline is not None and len(frames):
+                    # numpy releases the GIL during the processing of large arrays
+                    parts = np.array_split(np.arange(len(frames)), min(pipeline["workers"], len(frames)))
+                    results = list(
+                        executor.map(
+                            process,
+                            [batch[part] for part in parts],
+                            [scaling[part] for part in parts],
+                            [pipeline["stages"]] * len(parts),
+                        )
+                    )
+                    batch, scaling = (
+                        np.concatenate([data for data, _ in results]),
+                        np.concatenate([s for _, s in results]),
+                    )
+                for frame, data, frame_scaling in zip(frames, batch, scaling, strict=True):
+                    if frame["point"] != point:
+                        journal.end_point()
+                        point_files.close()
+                        point = frame["point"]
+                        filename = point_filename(frame["x"], frame["y"])
+                        # The summary is kept until the end of the point: it holds copies of the shared memory
+                        summary = {
+                            "dtype": str(data.dtype),
+                            "samples": data.shape[-1],
+                            "scaling": np.array(frame_scaling),
+                            "channel_scale": np.array(frame["range"]),
+                        }
+                        if channels is not None:
+                            summary["channels"] = np.array(channels)
+                        if average:
+                            summary["mean"], summary["averages"] = np.array(data), runs_per_measure
+                        if labels is not None and labels["fixed_key"]:
+                            summary["key"] = np.array(frame["labels"][:16])
+                        # Error counts of a resumed point are kept up to its first run acquired again
+                        run = int(frame["run"])
+                        errors = load_errors(out_directory, filename)[:run].tolist() if run > 0 else []
+                        errors += [0] * (run - len(errors))
+                        write_summary(out_directory, filename, **summary, **pack_errors(errors))
+                        names = (
+                            []
+                            if average or not store
+                            else [measures_file(filename, channel) for channel in channels or [None]]
+                        )
+                        names.append(labels_file(filename) if labels is not None else f"{filename}.info.txt")
+                        files = [
+                            point_files.enter_context(open(os.path.join(out_directory, name), mode="ab"))
+                            for name in names
+                        ]
+                        journal.start_point(int(point), filename, files)
+                        width = label_width(summary)
+
+                    *measures_files, info_file = files
+                    for file, trace in zip(measures_files, data.reshape(-1, data.shape[-1]), strict=False):
+                        file.write(trace.tobytes())
+                    errors.append(int(frame["errors"]))
+                    if labels is not None:
+                        info_file.write(frame["labels"][LABEL_SIZE - width :].tobytes())
+                    else:
+                        info_file.write(frame["info"] + b"\n")
+                    journal.commit(int(point), int(frame["run"]), bool(frame["last"]))
+                    if frame["last"]:
+                        save_summary()  # the point is complete, and may be scored once the ring buffer is drained
+
+                reader.release(len(frames))
+                if not len(frames):
+                    journal.sync()
+                    orphaned = parent is not None and not parent.is_alive()
+        finally:
+            journal.end_point()
+            point_files.close()
+            journal.close()
+            if executor is not None:
+                executor.shutdown()
+            # Views on the shared memory must be deleted before releasing it
+            frames = frame = batch = scaling = data = frame_scaling = None
+            ring.release()
+            if orphaned:
+                ring.unlink()
+
+
+def _point_ranges(frames):
+    """Get the (start, stop) ranges of the frames of each point, whose measures are contiguous"""
+    if not len(frames):
+        return []
+    starts = list(np.flatnonzero(np.diff(frames["point"], prepend=-1) != 0))
+    return zip(starts, [*starts[1:], len(frames)], strict=True)
+
+
+def _run_cpa_thread(ring, consumer, labels, cpa_refresher):
+    """Live correlation power analysis thread: analyse the measures published in the ring buffer, restarting
+    at each point. Measures are skipped when the analysis falls behind the acquisition. The key and plaintext
+    are read from the binary labels when the acquisition stores them. Once the analysis has stopped, measures
+    are still read until the end of the acquisition, so that the thread only ends with the ring buffer"""
+    reader = Consumer(ring, consumer)
+    cpa, point, coords, key = None, None, None, None
+    stopped = False
+    last_refresh = -float("inf")
+    frames = None
+    try:
+        while not reader.finished():
+            frames = reader.peek(timeout=CPA_REFRESH_INTERVAL)
+            batch = np.array(frames)  # copied at once, as the producer does not wait for this consumer
+            reader.release(len(frames))
+            frames = None
+            if stopped:
+                continue
+
+            for start, stop in _point_ranges(batch):
+                group = batch[start:stop]
+                if group["point"][0] != point:
+                    point, coords = group["point"][0], (float(group["x"][0]), float(group["y"][0]))
+                    cpa, key = CPA(group["data"].shape[-1]), None
+                try:
+                    if labels:
+                        keys, plaintexts = group["labels"][:, :16], group["labels"][:, 16:32]
+                    else:
+                        keys, plaintexts, _ = parse_info(list(group["info"]))
+                except ValueError:
+                    log("Acquisition - Live CPA stopped: the Target Board information has no key and plaintext")
+                    cpa, stopped = None, True
+                    break
+                key = keys[0] if key is None else key
+                cpa.update(group["data"].reshape(len(group), -1, group["data"].shape[-1])[:, 0], plaintexts)
+
+            now = time.monotonic()
+            if cpa is not None and cpa.count > 1 and (now - last_refresh >= CPA_REFRESH_INTERVAL or reader.finished()):
+                last_refresh = now
+                cpa_refresher(coords, cpa.best_guess().tolist(), cpa.key_rank(key).tolist())
+    finally:
+        frames = None  # views on the shared memory must be deleted before releasing it
+
+
+def _run_tvla_thread(ring, consumer, out_directory, rebuild, tvla_refresher):
+    """Live leakage assessment thread: accumulate the measures published in the ring buffer by class, for each point.
+    The accumulators of each point are saved at each refresh with their number of runs, and restored when the point
+    is resumed if they hold its committed runs. Otherwise, they are rebuilt from the stored measures when these are
+    the measured data, or the assessment of the point restarts"""
+    reader = Consumer(ring, consumer)
+    tvla, point, coords, filename, runs = None, None, None, None, 0
+    last_refresh = -float("inf")
+    frames = None
+
+    def refresh():
+        save_tvla(out_directory, filename, tvla, runs)
+        if tvla_refresher is not None:
+            tvla_refresher(coords, *tvla.max_t())
+
+    try:
+        while not reader.finished():
+            frames = reader.peek(timeout=TVLA_REFRESH_INTERVAL)
+            for start, stop in _point_ranges(frames):
+                group = frames[start:stop]
+                if group["point"][0] != point:
+                    if tvla is not None:
+                        refresh()
+                    point, coords = group["point"][0], (float(group["x"][0]), float(group["y"][0]))
+                    filename = point_filename(group["x"][0], group["y"][0])
+                    runs = int(group["run"][0])  # runs of the point committed to the journal
+                    tvla = load_tvla(out_directory, filename, runs) if runs > 0 else None
+                    if tvla is None and runs > 0 and rebuild:
+                        tvla = tvla_point(out_directory, filename, runs)
+                        tvla = tvla if tvla.count.sum() == runs else None
+                    if tvla is None and runs > 0:
+                        log(f"Acquisition - Leakage assessment of {coords} restarted from its run {runs}")
+                    tvla = tvla if tvla is not None else TVLA(group["data"].shape[-1])
+                try:
+                    classes = parse_classes(list(group["info"]))
+                except ValueError:
+                    log("Acquisition - Leakage assessment stopped: the Target Board information has no class")
+                    return
+                tvla.update(group["data"].reshape(len(group), -1, group["data"].shape[-1])[:, 0], classes)
+                runs = int(group["run"][-1]) + 1
+            reader.release(len(frames))
+            frames = group = None
+
+            now = time.monotonic()
+            if tvla is not None and (now - last_refresh >= TVLA_REFRESH_INTERVAL or reader.finished()):
+                last_refresh = now
+                refresh()
+    finally:
+        frames = group = None  # views on the shared memory must be deleted before releasing it
+
+
+def _get_data(oscilloscope, settings):
+    """Get the measured data of the channels of the acquisition settings"""
+    if settings["channels"] is None:
+        return oscilloscope.get_data()
+    return oscilloscope.get_data(settings["channels"])
+
+
+def _get_result(board, settings):
+    """Wait for the end of the run of the target board, and get its errors and information, as binary labels
+    when the acquisition stores them"""
+    if settings["labels"] is None:
+        return board.get()
+    errors, labels = board.get(binary=True)
+    return errors, np.frombuffer(bytes(labels), dtype=np.uint8)
+
+
+class _Schedule:
+    """Position the seeded fixed-vs-random schedule of the target board, for boards which have one (eg: ChipWhisperer),
+    before each attempt of a run to be committed. The runs which are not stored (pilot traces, reference trace,
+    missed triggers, retries...) then do not shift the schedule, and a resumed acquisition continues its sequence"""
+
+    def __init__(self, board, runs):
+        board_settings = json.loads(board.get_settings())
+        self._board = board
+        self._settings = board_settings if board_settings.get("tvla_seed") is not None else None
+        self.runs = runs  # runs committed to the journal or published to the writer process
+
+    def __call__(self):
+        if self._settings is not None:
+            self._settings["tvla_run"] = self.runs
+            self._board.set_settings(json.dumps(self._settings))
+
+
+def _check_labels(board, settings):
+    """Check the labels of the target board before the acquisition, running it twice without measure: they must
+    be a key, a text and a result, and the key must not change when it is fixed"""
+    keys = []
+    for _ in range(2):
+        board.run()
+        _, labels = _get_result(board, settings)
+        if labels.shape != (LABEL_SIZE,):
+            raise ValueError(f"Target Board labels must be {LABEL_SIZE} bytes: key, text and result")
+        keys.append(labels[:16])
+    if settings["labels"]["fixed_key"] and not np.array_equal(*keys):
+        raise ValueError("The key of the Target Board is not fixed: disable fixed_key in the labels settings")
+
+
+def _measure(board, oscilloscope, settings, executor, schedule=None):
+    """Run the target board once and get the measured data
+
+    In sequence and average capture, the oscilloscope is armed before the run. The board result is then read
+    while the waveform is transferred, and the run is done again if the oscilloscope missed the trigger.
+    The schedule of the target board, if given, is positioned before each attempt.
+
+    Returns:
+        Tuple of (errors, info, data)
+    """
+    if settings["capture"] == "continuous":
+        if schedule is not None:
+            schedule()
+        board.run()
+        errors, info = _get_result(board, settings)
+        return errors, info, _get_data(oscilloscope, settings)
+
+    for _ in range(MAX_MISSED_TRIGGERS):
+        oscilloscope.arm()
+        if schedule is not None:
+            schedule()
+        board.run()
+        result = executor.submit(_get_result, board, settings)
+        count = oscilloscope.wait()
+        data = _get_data(oscilloscope, settings) if count == 1 else None
+        errors, info = result.result()
+        if data is not None:
+            return errors, info, data
+        log(f"Acquisition - {'Missed' if count == 0 else 'Extra'} trigger ({count} acquisitions)")
+    raise Exception(f"Oscilloscope missed {MAX_MISSED_TRIGGERS} consecutive triggers")
+
+
+def _measure_average(board, oscilloscope, settings, runs, stop_event):
+    """Run the target board several times while the oscilloscope averages the measured data. The runs are
+    done again if the oscilloscope missed a trigger
+
+    Returns:
+        Tuple of (list of (errors, info) of each run, averaged data), or None if the acquisition has been stopped
+    """
+    for _ in range(MAX_MISSED_TRIGGERS):
+        oscilloscope.arm(runs)
+        results = []
+        for _ in range(runs):
+            if stop_event.is_set():
+                return None
+            board.run()
+            results.append(_get_result(board, settings))
+        count = oscilloscope.wait()
+        if count >= runs:
+            return results, _get_data(oscilloscope, settings)
+        log(f"Acquisition - Missed triggers ({count} acquisitions for {runs} runs)")
+    raise Exception(f"Oscilloscope missed triggers during {MAX_MISSED_TRIGGERS} consecutive averaged acquisitions")
+
+
+def _prepare(data, windows):
+    """Keep the samples of the windows of measured data, in native byte order"""
+    if windows is not None and (len(windows) > 1 or windows[0] != (0, data.shape[-1])):
+        data = crop(data, windows)
+    return data.astype(data.dtype.newbyteorder("="), copy=False)
+
+
+def _create_aligner(board, oscilloscope, settings, executor, out_directory, windows, resume):
+    """Create the alignment of the traces, on the first channel of a reference trace measured at the first point,
+    or loaded when resuming an acquisition"""
+    reference = load_reference(out_directory) if resume else None
+    if reference is None:
+        data = _prepare(_measure(board, oscilloscope, settings, executor)[2], windows)
+        reference = data.reshape(-1, data.shape[-1])[0]
+        save_reference(out_directory, reference)
+    return Aligner(
+        reference, settings["align"]["window"], settings["align"]["max_shift"], settings["align"]["min_correlation"]
+    )
+
+
+def _measure_valid(board, oscilloscope, settings, executor, windows, aligner, quality, schedule):
+    """Run the target board and get the measured data, see _measure(). When the traces are aligned, the run is done
+    again until a trace is accepted by the alignment. Traces rejected by the quality filter are measured again,
+    up to the retry budget of the run"""
+    misaligned, retries = 0, 0
+    while True:
+        errors, info, data = _measure(board, oscilloscope, settings, executor, schedule)
+        data = _prepare(data, windows)
+        if aligner is not None:
+            aligned, _, _, accepted = aligner.align(data[None])
+            if not accepted[0]:
+                misaligned += 1
+                if quality is not None:
+                    quality.reject("misaligned")
+                if misaligned >= MAX_MISALIGNED_TRACES:
+                    raise Exception(f"{MAX_MISALIGNED_TRACES} consecutive traces have been rejected by the alignment")
+                continue
+            data = aligned[0]
+        if quality is None:
+            return errors, info, data
+
+        reason = quality.check(errors, data)
+        if reason is None or retries >= quality.settings["retries"]:
+            quality.accept(data, exhausted=reason is not None)
+            return errors, info, data
+        quality.reject(reason)
+        retries += 1
+
+
+def _select_windows(board, oscilloscope, settings, executor, out_directory, resume):
+    """Select the windows of samples to keep from pilot traces, or load them when resuming an acquisition.
+    The oscilloscope is set to transfer the smallest range of samples which contains every window
+
+    Returns:
+        Tuple of (waveform settings to restore at the end of the acquisition, windows relative to the transferred
+        samples)
+    """
+    waveform = json.loads(oscilloscope.get_waveform())
+    poi = load_windows(out_directory) if resume else None
+    if poi is None:
+        pilots = np.array(
+            [_measure(board, oscilloscope, settings, executor)[2] for _ in range(settings["poi"]["pilot_traces"])]
+        )
+        windows = select_windows(pilots, settings["poi"]["threshold"], settings["poi"]["margin"])
+        if not windows:
+            log("Acquisition - No activity found in pilot traces, every sample is kept")
+            windows = [(0, pilots.shape[1])]
+        start = int(float(waveform.get("start", 1)))
+        save_windows(out_directory, start, windows)
+    else:
+        start, windows = poi
+
+    first, last = windows[0][0], windows[-1][1]
+    if "start" in waveform and "stop" in waveform:
+        oscilloscope.set_waveform(json.dumps({**waveform, "start": start + first, "stop": start + last - 1}))
+        windows = [(window_start - first, window_stop - first) for window_start, window_stop in windows]
+    log(f"Acquisition - Points of interest: {windows}")
+    return waveform, windows
+
+
+def _autorange(board, oscilloscope, settings, executor, channel, index=None):
+    """Set the vertical scale of a channel so that the peak of pilot traces reaches the target fraction
+    of the full range of the samples. The scale is doubled while the traces are clipped
+
+    Args:
+        index: index of the channel in the measured data, for acquisitions on several channels
+
+    Returns:
+        The vertical scale of the channel
+    """
+    channel_settings = json.loads(oscilloscope.get_channel(channel))
+    scale = float(channel_settings["scale"])
+    target = settings["autorange"]["target"]
+    for _ in range(settings["autorange"]["iterations"]):
+        pilots = np.array(
+            [_measure(board, oscilloscope, settings, executor)[2] for _ in range(settings["autorange"]["pilot_traces"])]
+        )
+        if index is not None:
+            pilots = pilots[:, index]
+        peak = np.abs(pilots.astype(np.int64)).max() / np.iinfo(pilots.dtype).max
+        if peak == 0:
+            break
+        new_scale = scale * 2 if peak >= CLIP_LEVEL else scale * peak / target
+        if abs(new_scale / scale - 1) < 0.1:
+            break
+        scale = new_scale
+        oscilloscope.set_channel(channel, json.dumps({**channel_settings, "scale": scale}))
+    return scale
+
+
+def _set_vertical_range(board, oscilloscope, settings, executor, out_directory, filename, resume):
+    """Auto-range the channels of the acquisition at a point. The channels of a resumed point are set back
+    to the scales recorded in its summary, so that all its measures share the same scaling
+
+    Returns:
+        Tuple of (scaling, channel scales) of the channels, see the summary of the points
+    """
+    channels = settings["channels"] or [json.loads(oscilloscope.get_waveform())["source"]]
+    summary = read_summary(out_directory, filename) if resume else None
+    if summary is not None:
+        scales = np.atleast_1d(summary["channel_scale"])
+        for channel, scale in zip(channels, scales, strict=True):
+            channel_settings = json.loads(oscilloscope.get_channel(channel))
+            oscilloscope.set_channel(channel, json.dumps({**channel_settings, "scale": float(scale)}))
+    else:
+        indexes = range(len(channels)) if settings["channels"] else [None]
+        scales = [
+            _autorange(board, oscilloscope, settings, executor, channel, index)
+            for channel, index in zip(channels, indexes, strict=True)
+        ]
+    log(f"Acquisition - Vertical scales at {filename}: {dict(zip(channels, map(float, scales), strict=True))}")
+    return _get_scaling(oscilloscope, settings), np.array(
+        scales if settings["channels"] else scales[0], dtype=np.float64
+    )
+
+
+def _get_scaling(oscilloscope, settings):
+    """Get the scaling of the channels of the acquisition settings"""
+    if settings["channels"] is None:
+        return np.array(oscilloscope.get_scaling())
+    return np.array([oscilloscope.get_scaling(channel) for channel in settings["channels"]])
+
+
+def _iterate_points(points, refine=None):
+    """Iterate over the points of the acquisition. Once every point has been acquired, the points returned
+    by the refine function are added to the acquisition, until it returns no point
+
+    Yields:
+        Tuple of (index, (x,y) coordinates) of each point
+    """
+    i = 0
+    while True:
+        while i < len(points):
+            yield i, points[i]
+            i += 1
+        new_points = refine() if refine is not None else None
+        if not new_points:
+            return
+        points.extend(new_points)
+
+
 def _run_acquisition_thread(
     board,
     oscilloscope,
@@ -60,32 +738,216 @@ def _run_acquisition_thread(
     points,
     runs_per_measure,
     out_directory,
+    settings,
+    completed,
+    cpa_refresher,
+    tvla_refresher,
+    error_refresher,
     stop_event,
 ):
-    """Acquisition thread"""
-    for i, (x, y) in enumerate(points):
-        positioning.move(x=x, y=y, absolute=True)
-        positioning.wait()
-        x, y, _ = positioning.locate()
-        ui_refresher(i * runs_per_measure, len(points) * runs_per_measure, (x, y))
-
-        for j in range(runs_per_measure):
-            if stop_event.is_set():
-                return
+    """Acquisition thread. An error stops the acquisition: it is logged and given to the error refresher,
+    once the measures already published have been stored"""
+    ui_refresher = _Throttle(ui_refresher, settings["refresh_rate"])
+    executor = ThreadPoolExecutor(max_workers=1)
+    ring, writer, cpa_thread, tvla_thread, frame = None, None, None, None, None
+    waveform, windows, aligner, schedule = None, None, None, None
+    scaling = None
+    channel_scale = np.full(len(settings["channels"]), np.nan) if settings["channels"] else np.nan
+    points = list(points)
+    pending = 1 if settings["refine"] is not None else 0  # the acquisition does not end before the last refinement
+    filenames = {}
+    scores = {}
+    quality = None
 
-            board.run()
-            errors, info = board.get()
-            data = oscilloscope.get_data()
+    def save_quality():
+        save_counters(out_directory, filenames[i], quality.counters)
+        rejected = {reason: count for reason, count in quality.counters.items() if count}
+        if rejected:
+            log(f"Acquisition - Traces rejected at ({x}, {y}): {rejected}")
+
+    def consumers_alive():
+        alive = writer.is_alive() and (tvla_thread is None or tvla_thread.is_alive())
+        return alive and (cpa_thread is None or cpa_thread.is_alive())
+
+    def refine():
+        # Points are scored once the writer process has stored all their measures
+        while ring is not None and not ring.drained() and consumers_alive():
+            time.sleep(0.01)
+        for i, filename in filenames.items():
+            if i not in scores:
+                scores[i] = point_value(out_directory, filename, settings["refine"]["metric"], settings["band"])
+        new_points = refine_quadtree(out_directory, scores, settings["refine"])
+        if new_points:
+            log(f"Acquisition - Refinement of the area of interest: {len(new_points)} new points")
+            extend_campaign(out_directory, points + new_points)
+        return new_points
+
+    try:
+        journal = read_journal(out_directory) if completed else {}
+        filenames = {i: filename for i, (filename, *_) in journal.items()}
+        if not completed:
+            remove_counters(out_directory)
+        if settings["tvla"] is not None:
+            schedule = _Schedule(board, sum(runs for _, runs, *_ in journal.values()))
+        if settings["labels"] is not None:
+            _check_labels(board, settings)
+
+        for i, (x, y) in _iterate_points(points, refine if settings["refine"] is not None else None):
+            start = completed.get(i, 0)
+            if start >= runs_per_measure:
+                continue
+
+            positioning.move(x=x, y=y, absolute=True)
+            positioning.wait()
+            x, y, _ = positioning.locate()
+            filenames[i] = point_filename(x, y)
+            ui_refresher(i * runs_per_measure + start, len(points) * runs_per_measure + pending, (x, y))
+
+            if settings["poi"] is not None and windows is None:
+                waveform, windows = _select_windows(
+                    board, oscilloscope, settings, executor, out_directory, bool(completed)
+                )
+
+            if settings["autorange"] is not None:
+                scaling, channel_scale = _set_vertical_range(
+                    board, oscilloscope, settings, executor, out_directory, point_filename(x, y), start > 0
+                )
+            elif scaling is None:
+                scaling = _get_scaling(oscilloscope, settings)
+
+            if settings["align"] is not None and aligner is None:
+                aligner = _create_aligner(
+                    board, oscilloscope, settings, executor, out_directory, windows, bool(completed)
+                )
+
+            if settings["capture"] == "average":
+                # Every run of the point is stored with the same averaged waveform
+                averaged = _measure_average(board, oscilloscope, settings, runs_per_measure, stop_event)
+                if averaged is None:
+                    return
+                results, data = averaged
+                data = _prepare(data, windows)
+                scaling = _get_scaling(oscilloscope, settings)
+
+            quality, key = None, None
+            if settings["quality"] is not None:
+                quality = QualityFilter(settings["quality"], scaling.reshape(-1, 4)[0, 0])
+
+            if settings["adaptive"] is not None:
+                y_mult = scaling.reshape(-1, 4)[0, 0]
+                convergence = Convergence(settings["adaptive"]["metric"], settings["adaptive"]["confidence"], y_mult)
+
+            for j in range(start, runs_per_measure):
+                if stop_event.is_set():
+                    return
+
+                if settings["capture"] == "average":
+                    errors, info = results[j]
+                else:
+                    errors, info, data = _measure_valid(
+                        board, oscilloscope, settings, executor, windows, aligner, quality, schedule
+                    )
+
+                last = j == runs_per_measure - 1
+                if settings["adaptive"] is not None:
+                    convergence.update(errors, data)
+                    last = last or convergence.converged(
+                        settings["adaptive"]["tolerance"], settings["adaptive"]["min_runs"]
+                    )
 
-            filename = f"{x}_{y}"
-            with open(os.path.join(out_directory, f"{filename}.measures.txt"), mode="a") as file:
-                file.write(",".join(map(str, data)) + "\n")
-            with open(os.path.join(out_directory, f"{filename}.errors.txt"), mode="a") as file:
-                file.write(str(errors) + "\n")
-            with open(os.path.join(out_directory, f"{filename}.info.txt"), mode="a") as file:
-                file.write(info + "\n")
+                if ring is None:
+                    # The size of the frames is known once the first measure is done
+                    dtype = _frame_dtype(data)
+                    # The leakage assessment needs every measure, the live CPA skips measures when it falls behind
+                    policies = [BLOCK]
+                    if settings["tvla"] is not None:
+                        policies.append(BLOCK)
+                    if settings["cpa"] and cpa_refresher is not None:
+                        policies.append(DROP)
+                    ring = RingBuffer.create(dtype, max(2, RING_SIZE // dtype.itemsize), policies)
+                    writer = multiprocessing.get_context("spawn").Process(
+                        target=_run_writer_process,
+                        args=(ring.spec(), 0, out_directory, settings, runs_per_measure),
+                    )
+                    writer.start()
+                    if settings["tvla"] is not None:
+                        # The stored measures are the measured data without pipeline
+                        rebuild = settings["tvla"]["store"] and settings["pipeline"] is None
+                        tvla_thread = threading.Thread(
+                            target=_run_tvla_thread, args=(ring, 1, out_directory, rebuild, tvla_refresher)
+                        )
+                        tvla_thread.start()
+                    if policies[-1] == DROP:
+                        cpa_thread = threading.Thread(
+                            target=_run_cpa_thread,
+                            args=(ring, len(policies) - 1, settings["labels"] is not None, cpa_refresher),
+                        )
+                        cpa_thread.start()
 
-            ui_refresher(i * runs_per_measure + j + 1, len(points) * runs_per_measure, (x, y))
+                if settings["labels"] is not None:
+                    # Checked before the acquisition, the fixed key is checked again over the runs of each point
+                    if settings["labels"]["fixed_key"]:
+                        key = info[:16] if key is None else key
+                        if not np.array_equal(info[:16], key):
+                            raise ValueError(
+                                "The key of the Target Board is not fixed: disable fixed_key in the labels settings"
+                            )
+                    labels, info = info, b""
+                else:
+                    info, labels = info.encode(), 0
+                    if len(info) > INFO_SIZE:
+                        raise ValueError(f"Target Board information exceeds {INFO_SIZE} bytes")
+
+                frame = ring.reserve(consumers_alive)
+                if frame is None:
+                    raise Exception("Writer process, leakage assessment or live CPA has stopped unexpectedly")
+                frame["point"], frame["run"], frame["x"], frame["y"] = i, j, x, y
+                frame["errors"], frame["info"], frame["labels"], frame["data"] = errors, info, labels, data
+                frame["scaling"], frame["range"], frame["last"] = scaling, channel_scale, last
+                ring.publish()
+                if schedule is not None:
+                    schedule.runs += 1
+
+                if last:
+                    if quality is not None:
+                        save_quality()
+                        quality = None
+                    if settings["adaptive"] is not None:
+                        value, half_width = convergence.interval()
+                        log(
+                            f"Acquisition - Point ({x}, {y}) stopped after {convergence.count} runs: "
+                            f"{value:g} ± {half_width:g}"
+                        )
+                    ui_refresher((i + 1) * runs_per_measure, len(points) * runs_per_measure + pending, (x, y))
+                    break
+                ui_refresher(i * runs_per_measure + j + 1, len(points) * runs_per_measure + pending, (x, y))
+
+        if pending:
+            ui_refresher(len(points) * runs_per_measure, len(points) * runs_per_measure, (x, y))
+    except Exception as e:
+        log(f"Acquisition - Error: {e}")
+        if error_refresher is not None:
+            error_refresher(str(e))
+    finally:
+        if quality is not None:
+            save_quality()
+        executor.shutdown()
+        if settings["capture"] != "continuous":
+            oscilloscope.disarm()
+        if waveform is not None:
+            oscilloscope.set_waveform(json.dumps(waveform))
+        if ring is not None:
+            frame = None
+            ring.close()
+            # The consumers are only joined if they have been started, so that their start error is not masked
+            if writer is not None and writer.pid is not None:
+                writer.join()
+            if tvla_thread is not None and tvla_thread.ident is not None:
+                tvla_thread.join()
+            if cpa_thread is not None and cpa_thread.ident is not None:
+                cpa_thread.join()
+            ring.release()
+            ring.unlink()
 
 
 def run_acquisition(
@@ -96,17 +958,31 @@ def run_acquisition(
     points,
     runs_per_measure,
     out_directory,
+    settings=DEFAULT_SETTINGS,
+    completed=None,
+    cpa_refresher=None,
+    tvla_refresher=None,
+    error_refresher=None,
 ):
-    """Run acquisition in a separate thread
+    """Run acquisition in a separate thread. Measures are stored by a separate process, which reads them
+    from a shared memory ring buffer
 
     Args:
         board: device for target board
         oscilloscope: device for oscilloscope
         positioning: device for positioning system
-        ui_refresher: function to call to refresh the ui during the acquisition
+        ui_refresher: function to call to refresh the ui during the acquisition, from the acquisition thread
         points: list of (x,y) coordinates to go to during the acquisition
         runs_per_measure: number of measures to run per point
         out_directory: output directory
+        settings: dict of acquisition settings, see parse_settings()
+        completed: dict of {point index: completed runs} to skip when resuming a campaign
+        cpa_refresher: function to call with ((x,y), best key guess, key rank) during the live correlation power
+            analysis, from the analysis thread
+        tvla_refresher: function to call with ((x,y), first order max |t|, second order max |t|) during the live
+            leakage assessment, from the assessment thread
+        error_refresher: function to call with the error message when the acquisition stops on an error,
+            from the acquisition thread
 
     Returns:
         Tuple of (thread, stop_event), required to stop the new thread
@@ -122,6 +998,11 @@ def run_acquisition(
             points,
             runs_per_measure,
             out_directory,
+            settings,
+            completed or {},
+            cpa_refresher,
+            tvla_refresher,
+            error_refresher,
             stop_event,
         ),
     )
@@ -143,41 +1024,70 @@ def stop_acquisition(board, thread, event):
             thread.join()
 
 
-def parse_out_directory(out_directory, errors_data):
-    """Parse an output directory to retrieve measure intensity or error mean for each point
+def point_value(out_directory, filename, metric="activity", band=None):
+    """Get the measure intensity, error mean, maximum signal to noise ratio or band power of a point
 
     Args:
         out_directory: output directory in which measures are stored
-        errors_data: count errors instead of measured data
+        filename: base name of the files of the point
+        metric: value of the point, see METRICS, or "band" for the power in a frequency band
+        band: [low, high] frequency band of the band power, in Hz
+
+    Returns:
+        The value of the point
+    """
+    value = 0
+
+    if metric == "errors":
+        errors = load_errors(out_directory, filename)
+        return float(errors.mean()) if len(errors) else value
+
+    summary = read_summary(out_directory, filename)
+    if summary is None:
+        with open(os.path.join(out_directory, f"{filename}.measures.txt")) as f:
+            lines = f.readlines()
+        for line in lines:
+            measure = np.fromstring(line, sep=",")
+            val = np.mean(np.abs(measure - measure.mean()))  # recenter measure and get mean of absolute
+            value += val / len(lines)
+        return value
+
+    # The signal to noise ratio groups the measures by the S-box output of the first key byte
+    if metric == "snr":
+        return snr_point(out_directory, filename).max_snr()
+    if metric == "band":
+        return band_power_point(out_directory, filename, band)
+
+    # Binary measures are converted to volts, as each point may have its own vertical scale
+    return activity_chunk(out_directory, filename).value()
+
+
+def parse_out_directory(out_directory, metric="activity", band=None):
+    """Parse an output directory to retrieve measure intensity, error mean, maximum signal to noise ratio
+    or band power for each point
+
+    Args:
+        out_directory: output directory in which measures are stored
+        metric: value of the points, see point_value()
+        band: [low, high] frequency band of the band power, in Hz
 
     Returns:
         Dict of {(x,y): value} with value for each (x,y) coordinates
     """
+    if metric == "band":
+        return band_power_map(out_directory, band)
+    if metric == "errors":
+        return fault_rate_map(out_directory)
+
     data = {}
-    files = [f for f in os.listdir(out_directory) if os.path.isfile(os.path.join(out_directory, f))]
-
-    for file in files:
-        with open(os.path.join(out_directory, file)) as f:
-            value = 0
-
-            if file.endswith(".errors.txt") and errors_data:
-                lines = f.readlines()
-                for line in lines:
-                    mean = np.fromstring(line, sep=",").mean()
-                    value += mean / len(lines)
-
-            elif file.endswith(".measures.txt") and not errors_data:
-                lines = f.readlines()
-                for line in lines:
-                    measure = np.fromstring(line, sep=",")
-                    val = np.mean(np.abs(measure - measure.mean()))  # recenter measure and get mean of absolute
-                    value += val / len(lines)
-
-            else:
-                continue
+    if metric == "snr":
+        filenames = list_points(out_directory)
+    else:
+        ext = ".measures.txt"
+        filenames = [f[: -len(ext)] for f in os.listdir(out_directory) if f.endswith(ext)]
+        filenames += list_points(out_directory)
 
-            coords = file.replace(".errors.txt", "").replace(".measures.txt", "").split("_")
-            x, y = float(coords[0]), float(coords[1])
-            data[(x, y)] = value
+    for filename in filenames:
+        data[point_coords(filename)] = point_value(out_directory, filename, metric)
 
     return data
@@ -0,0 +1,229 @@
+import contextlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from app.utils.storage import (
+    label_width,
+    labels_file,
+    list_points,
+    load_errors,
+    load_measures,
+    measures_file,
+    pack_errors,
+    read_summary,
+    write_summary,
+)
+
+ALIGNMENT_FILE = "alignment.npy"
+
+# Default settings of the alignment of the traces
+DEFAULT_ALIGN_SETTINGS = {
+    "window": None,  # [start, stop] samples of the reference pattern, in the reference trace
+    "max_shift": 50,  # maximum shift of a trace, in samples
+    "min_correlation": 0.5,  # minimum correlation of a trace with the reference pattern
+}
+
+# Number of traces aligned at once in an offline pass
+CHUNK_SIZE = 1024
+
+
+def parse_alignment(settings: dict) -> dict:
+    """Check the settings of the alignment, using default values for missing settings"""
+    settings = {**DEFAULT_ALIGN_SETTINGS, **settings}
+    for key in settings:
+        if key not in DEFAULT_ALIGN_SETTINGS:
+            raise ValueError(f"Unknown alignment setting: {key}")
+    window = settings["window"]
+    if window is None or len(window) != 2 or not 0 <= window[0] < window[1]:
+        raise ValueError(f"Invalid alignment window: {window}")
+    if settings["max_shift"] < 0:
+        raise ValueError(f"Invalid alignment maximum shift: {settings['max_shift']}")
+    return settings
+
+
+class Aligner:
+    """
+    Alignment of traces on a pattern of a reference trace. Each trace is cross-correlated with the pattern in the
+    frequency domain, for a batch of traces at once, and shifted to the position of its best match. The correlation
+    coefficient of each position is normalized by the energy of the trace under the pattern, computed from
+    cumulative sums. Traces whose best match within max_shift samples correlates less than min_correlation
+    are rejected.
+    """
+
+    def __init__(self, reference: np.ndarray, window: list[int], max_shift: int, min_correlation: float):
+        """Initialize the alignment
+
+        Args:
+            reference: reference trace, of shape (samples,)
+            window: [start, stop] samples of the pattern, in the reference trace
+            max_shift: maximum shift of a trace, in samples
+            min_correlation: minimum correlation of a trace with the pattern
+        """
+        self.reference = np.asarray(reference)
+        self.start, stop = window
+        pattern = self.reference[self.start : stop].astype(np.float64)
+        pattern = pattern - pattern.mean()
+        norm = np.linalg.norm(pattern)
+        if not len(pattern) or norm == 0:
+            raise ValueError("The alignment pattern of the reference trace is empty or flat")
+        self.pattern = pattern / norm
+        self.max_shift = max_shift
+        self.min_correlation = min_correlation
+
+    def align(self, traces: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Align a batch of traces
+
+        Args:
+            traces: array of traces, of shape (traces, samples), or (traces, channels, samples) to shift every channel
+                of the first one
+
+        Returns:
+            Tuple of (aligned traces, shift of each trace, correlation of each trace, whether each trace is accepted).
+            Samples shifted in from outside a trace repeat its edge
+        """
+        samples, length = traces.shape[-1], len(self.pattern)
+        if length > samples:
+            raise ValueError("The alignment pattern is longer than the traces")
+        x = traces.reshape(len(traces), -1, samples)[:, 0].astype(np.float64)
+
+        # Cross-correlation of every position of the pattern in the traces
+        n = samples + length
+        products = np.fft.irfft(np.fft.rfft(x, n) * np.conj(np.fft.rfft(self.pattern, n)), n)[:, : samples - length + 1]
+        sums = np.concatenate((np.zeros((len(x), 1)), np.cumsum(x, axis=1)), axis=1)
+        squares = np.concatenate((np.zeros((len(x), 1)), np.cumsum(x * x, axis=1)), axis=1)
+        window_sum = sums[:, length:] - sums[:, :-length]
+        energy = np.maximum(squares[:, length:] - squares[:, :-length] - window_sum**2 / length, 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            correlations = np.nan_to_num(products / np.sqrt(energy))
+
+        # Best match among the positions within the maximum shift
+        low, high = max(0, self.start - self.max_shift), min(samples - length, self.start + self.max_shift)
+        if low > high:
+            raise ValueError("The alignment window is out of the traces")
+        best = low + correlations[:, low : high + 1].argmax(axis=1)
+        correlation = correlations[np.arange(len(x)), best]
+        shifts = best - self.start
+
+        indexes = np.clip(np.arange(samples) + shifts[:, None], 0, samples - 1)
+        shape = (len(traces),) + (1,) * (traces.ndim - 2) + (samples,)
+        aligned = np.take_along_axis(traces, indexes.reshape(shape), axis=-1)
+        return aligned, shifts, correlation, correlation >= self.min_correlation
+
+
+def save_reference(out_directory: str, reference: np.ndarray):
+    """Save the reference trace of the alignment of an acquisition"""
+    np.save(os.path.join(out_directory, ALIGNMENT_FILE), reference)
+
+
+def load_reference(out_directory: str) -> np.ndarray:
+    """Load the reference trace of the alignment of an acquisition, or None if its traces are not aligned"""
+    path = os.path.join(out_directory, ALIGNMENT_FILE)
+    if not os.path.isfile(path):
+        return None
+    return np.load(path)
+
+
+def align_point(out_directory: str, aligned_directory: str, filename: str, aligner: Aligner) -> tuple[int, int]:
+    """Align the measures of a point into another output directory. Rejected measures are removed, with their errors
+    and information or binary labels
+
+    Args:
+        out_directory: output directory
+        aligned_directory: output directory of the aligned measures
+        filename: base name of the files of the point
+        aligner: the alignment
+
+    Returns:
+        Tuple of (number of measures, number of rejected measures)
+    """
+    summary = read_summary(out_directory, filename)
+    channels = list(summary["channels"]) if "channels" in summary else [None]
+    measures = [load_measures(out_directory, filename, summary, channel) for channel in channels]
+    count = len(measures[0])
+    text = {}
+    errors = load_errors(out_directory, filename, summary)[:count]
+    for ext in ("errors.txt", "info.txt"):
+        path = os.path.join(out_directory, f"{filename}.{ext}")
+        if os.path.isfile(path):
+            with open(path, mode="rb") as f:
+                text[ext] = f.read().splitlines()[:count]
+    labels = None
+    path = os.path.join(out_directory, labels_file(filename))
+    if os.path.isfile(path):
+        labels = np.fromfile(path, dtype=np.uint8).reshape(-1, label_width(summary))[:count]
+
+    kept = np.zeros(count, dtype=bool)
+    with contextlib.ExitStack() as stack:
+        files = [
+            stack.enter_context(open(os.path.join(aligned_directory, measures_file(filename, channel)), mode="wb"))
+            for channel in channels
+        ]
+        for start in range(0, count, CHUNK_SIZE):
+            traces = np.stack([channel[start : start + CHUNK_SIZE] for channel in measures], axis=1)
+            aligned, _, _, accepted = aligner.align(traces)
+            kept[start : start + len(traces)] = accepted
+            for file, channel in zip(files, aligned[accepted].transpose(1, 0, 2), strict=True):
+                file.write(np.ascontiguousarray(channel).tobytes())
+
+    for ext, lines in text.items():
+        with open(os.path.join(aligned_directory, f"{filename}.{ext}"), mode="wb") as f:
+            f.write(b"".join(line + b"\n" for line, keep in zip(lines, kept, strict=False) if keep))
+    if labels is not None:
+        labels[kept[: len(labels)]].tofile(os.path.join(aligned_directory, labels_file(filename)))
+    summary = {
+        key: value for key, value in summary.items() if key not in ("runs", "errors", "errors_index", "errors_count")
+    }
+    if "errors.txt" not in text:
+        summary.update(pack_errors(errors[kept[: len(errors)]]))
+    write_summary(aligned_directory, filename, **summary)
+    return count, int(count - kept.sum())
+
+
+def align_directory(
+    out_directory: str,
+    aligned_directory: str,
+    settings: dict,
+    reference: np.ndarray = None,
+    workers: int | None = None,
+    progress=None,
+) -> dict:
+    """Align the measures of every point of an output directory into another output directory, one point per process.
+    Points acquired in average capture are skipped
+
+    Args:
+        out_directory: output directory
+        aligned_directory: output directory of the aligned measures
+        settings: alignment settings, see DEFAULT_ALIGN_SETTINGS
+        reference: reference trace, the reference of the acquisition or the first measure of the first point by default
+        workers: number of processes, the number of cpus by default
+        progress: function to call with (aligned points, total points)
+
+    Returns:
+        Dict of {filename: (number of measures, number of rejected measures)} for each point
+    """
+    settings = parse_alignment(settings)
+    filenames = [
+        filename for filename in list_points(out_directory) if "mean" not in read_summary(out_directory, filename)
+    ]
+    if reference is None:
+        reference = load_reference(out_directory)
+    if reference is None:
+        reference = np.array(load_measures(out_directory, filenames[0])[0])
+    aligner = Aligner(reference, settings["window"], settings["max_shift"], settings["min_correlation"])
+    os.makedirs(aligned_directory, exist_ok=True)
+    save_reference(aligned_directory, aligner.reference)
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = {
+            executor.submit(align_point, out_directory, aligned_directory, filename, aligner): filename
+            for filename in filenames
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            if progress is not None:
+                progress(len(results), len(filenames))
+    return results
@@ -0,0 +1,243 @@
+import json
+import os
+import time
+
+from app.analysis.snr import SNR_EXT
+from app.analysis.spectrum import SPECTRUM_EXT
+from app.analysis.tvla import TVLA_EXT
+from app.utils.storage import LABELS_EXT, MEASURES_EXT, SUMMARY_EXT
+
+CAMPAIGN_FILE = "campaign.json"
+JOURNAL_FILE = "campaign.journal"
+
+# Extensions of the files of the points, legacy text measures included, and of their cached analyses
+POINT_EXTS = (
+    MEASURES_EXT,
+    SUMMARY_EXT,
+    LABELS_EXT,
+    "measures.txt",
+    "info.txt",
+    "errors.txt",
+    SNR_EXT,
+    SPECTRUM_EXT,
+    TVLA_EXT,
+)
+
+# Maximum delay between two synchronizations of the journal, in seconds
+SYNC_INTERVAL = 2.0
+
+
+def _atomic_write(path: str, content: str):
+    """Write a file atomically: the file holds either its old or its new content, never a mix of both"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, mode="w") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def point_files(out_directory: str) -> list[str]:
+    """List the files of the points of a previous acquisition in an output directory
+
+    Args:
+        out_directory: output directory
+
+    Returns:
+        List of the filenames of the point files, temporary files included
+    """
+    exts = tuple(f".{ext}" for ext in POINT_EXTS)
+    return [file for file in os.listdir(out_directory) if file.removesuffix(".tmp").endswith(exts)]
+
+
+def _remove_points(out_directory: str):
+    """Remove the files of the points of a previous acquisition from an output directory, which would otherwise be
+    appended to"""
+    for file in point_files(out_directory):
+        os.remove(os.path.join(out_directory, file))
+
+
+def create_campaign(out_directory: str, points: list, runs_per_measure: int, settings: dict):
+    """Create a new campaign in an output directory, and clear any previous journal and point files
+
+    The caller is expected to confirm the removal of the point files listed by point_files() beforehand.
+
+    Args:
+        out_directory: output directory
+        points: list of (x,y) coordinates to go to during the acquisition
+        runs_per_measure: number of measures to run per point
+        settings: acquisition settings
+    """
+    campaign = {
+        "points": [list(point) for point in points],
+        "runs_per_measure": runs_per_measure,
+        "settings": settings,
+    }
+    _atomic_write(os.path.join(out_directory, CAMPAIGN_FILE), json.dumps(campaign, indent=4))
+    with open(os.path.join(out_directory, JOURNAL_FILE), mode="wb"):
+        pass  # the journal is emptied
+    _remove_points(out_directory)
+
+
+def extend_campaign(out_directory: str, points: list):
+    """Set the points of the campaign of an output directory, when points are added during the acquisition
+
+    Args:
+        out_directory: output directory
+        points: list of (x,y) coordinates of every point of the campaign, in the order of acquisition
+    """
+    path = os.path.join(out_directory, CAMPAIGN_FILE)
+    with open(path) as f:
+        campaign = json.loads(f.read())
+    campaign["points"] = [list(point) for point in points]
+    _atomic_write(path, json.dumps(campaign, indent=4))
+
+
+def load_campaign(out_directory: str) -> tuple[list, int, dict]:
+    """Load the campaign of an output directory
+
+    Args:
+        out_directory: output directory
+
+    Returns:
+        Tuple of (points, runs_per_measure, settings), as given to create_campaign
+    """
+    path = os.path.join(out_directory, CAMPAIGN_FILE)
+    if not os.path.isfile(path):
+        raise Exception("No campaign to resume in the output directory")
+    with open(path) as f:
+        campaign = json.loads(f.read())
+    return [tuple(point) for point in campaign["points"]], campaign["runs_per_measure"], campaign.get("settings", {})
+
+
+def read_journal(out_directory: str) -> dict:
+    """Read the journal of an output directory. A record which has been partially written is discarded,
+    and the journal is truncated after the last valid record
+
+    Args:
+        out_directory: output directory
+
+    Returns:
+        Dict of {point index: (filename, completed runs, {file: size}, ended)} for each started point, with the size
+        of each journaled file of the point after its last completed run, and whether its last run has been done
+    """
+    path = os.path.join(out_directory, JOURNAL_FILE)
+    if not os.path.isfile(path):
+        return {}
+
+    journal = {}
+    valid_size = 0
+    with open(path, mode="rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if "run" in record:
+                filename, _, _, _ = journal[record["point"]]
+                journal[record["point"]] = (filename, record["run"] + 1, record["sizes"], record.get("last", False))
+            elif record["point"] not in journal:  # a point is started again when the campaign is resumed
+                journal[record["point"]] = (record["filename"], 0, {file: 0 for file in record["files"]}, False)
+            valid_size += len(line)
+
+    if os.path.getsize(path) > valid_size:
+        os.truncate(path, valid_size)
+    return journal
+
+
+def resume_campaign(out_directory: str) -> tuple[list, int, dict, dict]:
+    """Prepare an output directory to resume its campaign: journaled files of each started point are truncated
+    to their size after the last completed run, to remove measures which have been partially written
+
+    Args:
+        out_directory: output directory
+
+    Returns:
+        Tuple of (points, runs_per_measure, settings, completed), with completed a dict of
+        {point index: completed runs}. Points whose runs have been stopped early count as complete
+    """
+    points, runs_per_measure, settings = load_campaign(out_directory)
+    journal = read_journal(out_directory)
+
+    for _, _, sizes, _ in journal.values():
+        for file, size in sizes.items():
+            path = os.path.join(out_directory, file)
+            if os.path.isfile(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+
+    completed = {i: runs_per_measure if ended else runs for i, (_, runs, _, ended) in journal.items()}
+    return points, runs_per_measure, settings, completed
+
+
+class Journal:
+    """Append-only journal of the (point, run) units completed during an acquisition.
+
+    Records are grouped and synchronized at most every SYNC_INTERVAL seconds: measure files are flushed
+    to the disk before the records that reference them, so that a record never points to missing data.
+    Data which is not appended to the files of a point, such as its summary, is saved by the before_sync function.
+    """
+
+    def __init__(self, out_directory: str, before_sync=None):
+        self._before_sync = before_sync
+        self._file = open(os.path.join(out_directory, JOURNAL_FILE), mode="ab")
+        self._files = []
+        self._pending = []
+        self._last_sync = time.monotonic()
+
+    def start_point(self, point: int, filename: str, files: list):
+        """Record the start of a point
+
+        Args:
+            point: index of the point
+            filename: base name of the files of the point
+            files: opened files of the point, which must be synchronized before any record of this point
+        """
+        self._files = files
+        self._pending.append(
+            {"point": point, "filename": filename, "files": [os.path.basename(file.name) for file in files]}
+        )
+
+    def commit(self, point: int, run: int, last: bool = False):
+        """Record a completed run
+
+        Args:
+            point: index of the point
+            run: index of the run
+            last: whether this is the last run of the point
+        """
+        sizes = {}
+        for file in self._files:
+            file.flush()
+            sizes[os.path.basename(file.name)] = file.tell()
+        record = {"point": point, "run": run, "sizes": sizes}
+        if last:
+            record["last"] = True
+        self._pending.append(record)
+        if time.monotonic() - self._last_sync > SYNC_INTERVAL:
+            self.sync()
+
+    def end_point(self):
+        """Record the end of a point: pending records are written before its files are closed"""
+        self.sync()
+        self._files = []
+
+    def sync(self):
+        """Write pending records to the disk"""
+        if self._pending:
+            if self._before_sync is not None:
+                self._before_sync()
+            for file in self._files:
+                file.flush()
+                os.fsync(file.fileno())
+            self._file.write(b"".join(json.dumps(record).encode() + b"\n" for record in self._pending))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._pending.clear()
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        """Write pending records and close the journal"""
+        self.sync()
+        self._file.close()
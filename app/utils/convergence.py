@@ -0,0 +1,99 @@
+import statistics
+
+import numpy as np
+
+from app.analysis.faults import wilson_interval
+
+# Metrics whose convergence can be followed
+METRICS = ("activity", "errors", "snr")
+
+# Default settings of the adaptive number of runs per point
+DEFAULT_ADAPTIVE_SETTINGS = {
+    "metric": "activity",  # "activity" (volts), "errors" (fraction of runs with errors) or "snr" (signal/noise ratio)
+    "tolerance": 0.001,  # maximum half-width of the confidence interval of the metric, in units of the metric
+    "confidence": 0.95,  # confidence level of the interval
+    "min_runs": 10,  # minimum number of runs per point, the maximum being the number of runs per measure
+}
+
+
+class Convergence:
+    """
+    Running mean and confidence interval of a metric over the runs of a point.
+
+    Activity is the mean of a value per run, with a normal confidence interval. The fraction of runs with errors
+    has a Wilson score interval, which does not collapse to 0 ± 0 before the first error. The SNR is the variance
+    of the mean trace over its samples, relative to the mean variance of the samples over the runs. Its interval is
+    a heuristic: the relative standard error of the variance of normal noise, sqrt(2 / (n - 1)), which ignores the
+    error of the signal variance and the correlation of the samples, so it is narrower than the true interval.
+    """
+
+    def __init__(self, metric: str, confidence: float, y_mult: float = 1):
+        """Initialize the metric of a point
+
+        Args:
+            metric: the followed metric, see METRICS
+            confidence: confidence level of the interval
+            y_mult: volts per unit of the measured data
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Invalid metric: {metric}")
+        self.metric = metric
+        self.count = 0
+        self._confidence = confidence
+        self._z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+        self._y_mult = y_mult
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    def update(self, errors: int, data: np.ndarray):
+        """Add a run (Welford's online algorithm)
+
+        Args:
+            errors: number of errors of the run
+            data: measured data of the run, of shape (samples,) or (channels, samples) to use the first channel
+        """
+        if self.metric == "errors":
+            value = float(errors > 0)
+        else:
+            trace = data.reshape(-1, data.shape[-1])[0].astype(np.float64)
+            value = np.mean(np.abs(trace - trace.mean())) * self._y_mult if self.metric == "activity" else trace
+
+        self.count += 1
+        delta = value - self._mean
+        self._mean = self._mean + delta / self.count
+        self._m2 = self._m2 + delta * (value - self._mean)
+
+    def interval(self) -> tuple[float, float]:
+        """Get the estimated metric
+
+        Returns:
+            Tuple of (value, half-width of the confidence interval), with an infinite half-width before 2 runs.
+            The value of the fraction of runs with errors is the center of its Wilson score interval
+        """
+        if self.metric == "errors" and self.count:
+            low, high = wilson_interval(self._mean * self.count, self.count, self._confidence)
+            return float((low + high) / 2), float((high - low) / 2)
+
+        if self.count < 2:
+            return float(np.mean(self._mean)), float("inf")
+
+        if self.metric == "snr":
+            # Heuristic interval, see the class description
+            noise = np.mean(self._m2 / (self.count - 1))
+            snr = np.var(self._mean) / noise if noise > 0 else float("inf")
+            return float(snr), float(self._z * snr * np.sqrt(2 / (self.count - 1)))
+
+        variance = self._m2 / (self.count - 1)
+        return float(self._mean), float(self._z * np.sqrt(variance / self.count))
+
+    def converged(self, tolerance: float, min_runs: int) -> bool:
+        """Check if the runs of the point can be stopped
+
+        Args:
+            tolerance: maximum half-width of the confidence interval
+            min_runs: minimum number of runs
+
+        Returns:
+            Whether the confidence interval is narrower than the tolerance after the minimum number of runs
+        """
+        return self.count >= min_runs and self.interval()[1] <= tolerance
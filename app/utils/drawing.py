@@ -1,6 +1,6 @@
 from PySide6 import QtGui
-from PySide6.QtCore import Qt
-from PySide6.QtWidgets import QGraphicsEllipseItem
+from PySide6.QtCore import QPointF, Qt
+from PySide6.QtWidgets import QGraphicsEllipseItem, QGraphicsPolygonItem
 
 from app.utils.logging import log
 from app.utils.positioning import dist, point_on_line
@@ -168,6 +168,27 @@ def display_data(scene, data, displayed_data):
         displayed_data.append(circle)
 
 
+def display_cells(scene, cells, values, displayed_data):
+    """Draw measures summary of the cells of a refined area"""
+    if not len(cells):
+        return
+
+    minval = min(values)
+    maxval = max(values)
+    for cell, value in zip(cells, values, strict=True):
+        val = 0
+        if maxval - minval > 0:
+            val = (value - minval) / (maxval - minval)
+
+        polygon = QGraphicsPolygonItem(QtGui.QPolygonF([QPointF(x, y) for x, y in cell]))
+        polygon.setPen(QtGui.QPen(QtGui.QColor(255, 0, 0), DRAW_SIZE / 5, Qt.SolidLine))
+        polygon.setBrush(QtGui.QColor(255, int(255 * (1 - val)), 0))
+        polygon.setOpacity(0.2 + 0.6 * val)
+
+        scene.addItem(polygon)
+        displayed_data.append(polygon)
+
+
 def hide_data(scene, displayed_data):
     """Clear measures summary"""
     try:
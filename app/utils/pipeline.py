@@ -0,0 +1,125 @@
+import numpy as np
+
+# Default settings of the pre-processing of the measures before they are stored
+DEFAULT_PIPELINE_SETTINGS = {
+    "stages": [],  # list of stages applied in order, eg: [{"stage": "dc"}, {"stage": "decimate", "factor": 4}]
+    "workers": 1,  # number of threads processing the measures in the writer process
+}
+
+# Parameters of each stage, with their default value (None for a required parameter)
+STAGES = {
+    "dc": {},  # remove the mean of each trace
+    "bandpass": {"low": None, "high": None},  # keep the frequencies of a band, in Hz
+    "decimate": {"factor": None},  # average groups of consecutive samples
+    "crop": {"start": 0, "stop": None},  # keep a range of samples, stop excluded
+    "int8": {
+        "range": None
+    },  # requantise to int8, with a full scale in volts (the range of the oscilloscope by default)
+}
+
+# Stages which keep the measured data: a pipeline of these stages only keeps the dtype and scaling of the measures,
+# the other stages convert the measures to volts (float32, or int8 after the int8 stage)
+RAW_STAGES = ("crop",)
+
+
+def parse_pipeline(settings: dict) -> dict:
+    """Check the settings of a pre-processing pipeline, using default values for missing settings
+
+    Args:
+        settings: the pipeline settings, see DEFAULT_PIPELINE_SETTINGS
+
+    Returns:
+        Dict of pipeline settings, with the parameters of each stage
+    """
+    settings = {**DEFAULT_PIPELINE_SETTINGS, **settings}
+    for key in settings:
+        if key not in DEFAULT_PIPELINE_SETTINGS:
+            raise ValueError(f"Unknown pipeline setting: {key}")
+    if not isinstance(settings["workers"], int) or settings["workers"] < 1:
+        raise ValueError(f"Invalid pipeline workers: {settings['workers']}")
+
+    stages = []
+    for i, stage in enumerate(settings["stages"]):
+        name = stage.get("stage")
+        if name not in STAGES:
+            raise ValueError(f"Unknown pipeline stage: {name}")
+        if name == "int8" and i != len(settings["stages"]) - 1:
+            raise ValueError("The int8 stage must be the last stage of the pipeline")
+        params = {key: value for key, value in stage.items() if key != "stage"}
+        for key in params:
+            if key not in STAGES[name]:
+                raise ValueError(f"Unknown parameter of the {name} stage: {key}")
+        params = {**STAGES[name], **params}
+        for key, value in params.items():
+            if value is None and key not in ("stop", "range"):
+                raise ValueError(f"Missing parameter of the {name} stage: {key}")
+        if name == "bandpass" and not 0 <= params["low"] < params["high"]:
+            raise ValueError(f"Invalid band: {params['low']}, {params['high']}")
+        if name == "decimate" and (not isinstance(params["factor"], int) or params["factor"] < 1):
+            raise ValueError(f"Invalid decimation factor: {params['factor']}")
+        stages.append({"stage": name, **params})
+    settings["stages"] = stages
+    return settings
+
+
+def _bandpass(data: np.ndarray, x_incr: float, low: float, high: float) -> np.ndarray:
+    """Zero the frequencies of the traces which are out of a band"""
+    spectra = np.fft.rfft(data, axis=-1)
+    freqs = np.fft.rfftfreq(data.shape[-1], x_incr)
+    spectra[..., (freqs < low) | (freqs > high)] = 0
+    return np.fft.irfft(spectra, n=data.shape[-1], axis=-1)
+
+
+def _decimate(data: np.ndarray, factor: int) -> np.ndarray:
+    """Average groups of consecutive samples of the traces, dropping the last incomplete group"""
+    samples = data.shape[-1] // factor * factor
+    return data[..., :samples].reshape((*data.shape[:-1], -1, factor)).mean(axis=-1)
+
+
+def process(data: np.ndarray, scaling: np.ndarray, stages: list[dict]) -> tuple[np.ndarray, np.ndarray]:
+    """Apply the stages of a pipeline to a batch of measures. Measures are converted to volts before the first stage,
+    unless every stage keeps the measured data (see RAW_STAGES)
+
+    Args:
+        data: array of measures, of shape (traces, samples) or (traces, channels, samples)
+        scaling: array of the scaling of the measures, of shape data.shape[:-1] + (4,), see get_scaling()
+        stages: stages of the pipeline, see parse_pipeline()
+
+    Returns:
+        Tuple of (processed measures, scaling of the processed measures). Measures are in volts (float32),
+        or int8 after an int8 stage, or keep the dtype and scaling of the measured data
+    """
+    if all(stage["stage"] in RAW_STAGES for stage in stages):
+        for stage in stages:
+            data = data[..., stage["start"] : stage["stop"]]
+        return data, scaling
+
+    y_mult, y_offset, y_zero, x_incr = (scaling[..., i, None] for i in range(4))
+    full_scale = np.iinfo(data.dtype).max * np.abs(y_mult) if np.issubdtype(data.dtype, np.integer) else None
+    data = (data.astype(np.float64) - y_offset) * y_mult + y_zero
+    x_incr = float(x_incr.flat[0]) if x_incr.size else 1.0  # the horizontal settings are the same for every point
+    out_mult = np.ones(y_mult.shape)
+
+    for stage in stages:
+        if stage["stage"] == "dc":
+            data = data - data.mean(axis=-1, keepdims=True)
+        elif stage["stage"] == "bandpass":
+            data = _bandpass(data, x_incr, stage["low"], stage["high"])
+        elif stage["stage"] == "decimate":
+            data = _decimate(data, stage["factor"])
+            x_incr *= stage["factor"]
+        elif stage["stage"] == "crop":
+            data = data[..., stage["start"] : stage["stop"]]
+        elif stage["stage"] == "int8":
+            if stage["range"] is not None:
+                full_scale = np.full(y_mult.shape, float(stage["range"]))
+            elif full_scale is None:
+                raise ValueError("The int8 stage requires a range for measures which are not integers")
+            out_mult = full_scale / 127
+            data = np.clip(np.rint(data / out_mult), -127, 127).astype(np.int8)
+
+    if data.dtype != np.int8:
+        data = data.astype(np.float32)
+    out_scaling = np.zeros(scaling.shape)
+    out_scaling[..., 0], out_scaling[..., 3] = out_mult[..., 0], x_incr
+    return data, out_scaling
@@ -0,0 +1,81 @@
+import json
+import os
+
+import numpy as np
+
+POI_FILE = "poi.json"
+
+# Default settings of the point of interest selection
+DEFAULT_POI_SETTINGS = {
+    "pilot_traces": 50,  # number of traces measured to select the windows
+    "threshold": 5,  # minimum variance of an active sample, relative to the median variance
+    "margin": 20,  # number of samples kept around active samples
+}
+
+
+def select_windows(traces: np.ndarray, threshold: float, margin: int) -> list[tuple[int, int]]:
+    """Select the windows of samples which carry activity
+
+    Args:
+        traces: array of pilot traces, of shape (traces, samples), or (traces, channels, samples) to keep the
+            samples which are active on any channel
+        threshold: minimum variance of an active sample, relative to the median variance of the samples
+        margin: number of samples kept around active samples. Windows closer than the margin are merged
+
+    Returns:
+        List of (start, stop) sample indexes of each window, stop excluded
+    """
+    variance = np.var(traces.astype(np.float64), axis=0).reshape(-1, traces.shape[-1])
+    noise = np.median(variance, axis=1, keepdims=True)
+    active = np.where(noise > 0, variance > threshold * noise, variance > 0).any(axis=0)
+    if margin > 0:
+        active = np.convolve(active, np.ones(2 * margin + 1), mode="same") > 0
+
+    edges = np.diff(np.concatenate(([0], active.astype(np.int8), [0])))
+    starts, stops = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    return [(int(start), int(stop)) for start, stop in zip(starts, stops, strict=True)]
+
+
+def crop(data: np.ndarray, windows: list[tuple[int, int]]) -> np.ndarray:
+    """Keep the samples of the windows of a trace
+
+    Args:
+        data: measured trace, of shape (samples,) or (channels, samples)
+        windows: list of (start, stop) windows, relative to the start of the trace
+
+    Returns:
+        The samples of the windows, concatenated
+    """
+    if len(windows) == 1:
+        start, stop = windows[0]
+        return data[..., start:stop]
+    return np.concatenate([data[..., start:stop] for start, stop in windows], axis=-1)
+
+
+def save_windows(out_directory: str, start: int, windows: list[tuple[int, int]]):
+    """Save the windows selected for an acquisition
+
+    Args:
+        out_directory: output directory
+        start: first sample transferred by the oscilloscope (DATa:STARt), from 1
+        windows: list of (start, stop) windows, relative to the first transferred sample
+    """
+    with open(os.path.join(out_directory, POI_FILE), mode="w") as f:
+        f.write(json.dumps({"start": start, "windows": windows}, indent=4))
+
+
+def load_windows(out_directory: str) -> tuple[int, list[tuple[int, int]]]:
+    """Load the windows selected for an acquisition
+
+    Args:
+        out_directory: output directory
+
+    Returns:
+        Tuple of (start, windows) as given to save_windows, or None if no window has been selected
+    """
+    path = os.path.join(out_directory, POI_FILE)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        poi = json.loads(f.read())
+    return poi["start"], [tuple(window) for window in poi["windows"]]
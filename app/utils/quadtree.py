@@ -0,0 +1,178 @@
+import json
+import os
+
+from app.utils.positioning import point_on_line
+
+QUADTREE_FILE = "quadtree.json"
+
+# Default settings of the coarse-to-fine refinement of the area of interest
+DEFAULT_REFINE_SETTINGS = {
+    "metric": "activity",  # "activity", "errors" or "snr" (maximum signal to noise ratio of the S-box output)
+    "threshold": 0.5,  # minimum score of a cell to subdivide, relative to the range of the scores (0 to 1)
+    "gradient": 0.25,  # minimum score difference with a neighbouring cell to subdivide, relative to the score range
+    "depth": 3,  # maximum number of subdivisions of the coarse cells
+}
+
+
+def cell_point(corners: list, u: float, v: float) -> tuple[float, float]:
+    """Get the coordinates of a point of the area of interest
+
+    Args:
+        corners: the 4 corners of the area, in the order of the points which define the grid
+        u, v: relative position of the point in the area, from 0 to 1
+
+    Returns:
+        The (x,y) coordinates of the point
+    """
+    return point_on_line(point_on_line(corners[0], corners[1], u), point_on_line(corners[3], corners[2], u), v)
+
+
+def cell_center(corners: list, cell: dict) -> tuple[float, float]:
+    """Get the coordinates of the center of a cell"""
+    return cell_point(corners, cell["u"] + cell["size"] / 2, cell["v"] + cell["size"] / 2)
+
+
+def cell_polygon(corners: list, cell: dict) -> list[tuple[float, float]]:
+    """Get the coordinates of the 4 corners of a cell"""
+    u, v, size = cell["u"], cell["v"], cell["size"]
+    return [cell_point(corners, *uv) for uv in [(u, v), (u + size, v), (u + size, v + size), (u, v + size)]]
+
+
+def leaves(cells: list[dict]) -> list[dict]:
+    """Get the cells which have not been subdivided"""
+    return [cell for cell in cells if not cell["split"]]
+
+
+def _save(out_directory: str, corners: list, cells: list[dict]):
+    """Save a quadtree atomically"""
+    path = os.path.join(out_directory, QUADTREE_FILE)
+    with open(path + ".tmp", mode="w") as f:
+        f.write(json.dumps({"corners": corners, "cells": cells}, indent=4))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def create_quadtree(out_directory: str, corners: list, n: int) -> list[tuple[float, float]]:
+    """Create the quadtree of a coarse grid of the area of interest
+
+    Args:
+        out_directory: output directory
+        corners: the 4 corners of the area, in the order of the points which define the grid
+        n: size of the coarse grid
+
+    Returns:
+        List of (x,y) coordinates of the center of each cell, in the order of the boxes of the grid
+    """
+    cells = [
+        {"u": (i % n) / n, "v": (i // n) / n, "size": 1 / n, "level": 0, "point": i, "split": False}
+        for i in range(n**2)
+    ]
+    corners = [list(corner) for corner in corners]
+    _save(out_directory, corners, cells)
+    return [cell_center(corners, cell) for cell in cells]
+
+
+def remove_quadtree(out_directory: str):
+    """Remove the quadtree of a previous acquisition from an output directory"""
+    path = os.path.join(out_directory, QUADTREE_FILE)
+    if os.path.isfile(path):
+        os.remove(path)
+
+
+def load_quadtree(out_directory: str) -> tuple[list, list[dict]]:
+    """Load the quadtree of an output directory
+
+    Args:
+        out_directory: output directory
+
+    Returns:
+        Tuple of (corners, cells), or None if the acquisition has no quadtree. Each cell is a dict of its relative
+        position (u, v) and size in the area, its level of subdivision, the index of its point in the acquisition
+        and whether it has been subdivided
+    """
+    path = os.path.join(out_directory, QUADTREE_FILE)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        quadtree = json.loads(f.read())
+    return quadtree["corners"], quadtree["cells"]
+
+
+def quadtree_points(out_directory: str) -> list[tuple[float, float]]:
+    """Get the points of every cell of the quadtree of an output directory, ordered by index"""
+    corners, cells = load_quadtree(out_directory)
+    return [cell_center(corners, cell) for cell in sorted(cells, key=lambda cell: cell["point"])]
+
+
+def _adjacent(cell1: dict, cell2: dict) -> bool:
+    """Check if two cells share a part of an edge"""
+    u1, v1, s1 = cell1["u"], cell1["v"], cell1["size"]
+    u2, v2, s2 = cell2["u"], cell2["v"], cell2["size"]
+    eps = 1e-9
+    overlap_u = u1 < u2 + s2 - eps and u2 < u1 + s1 - eps
+    overlap_v = v1 < v2 + s2 - eps and v2 < v1 + s1 - eps
+    touch_u = abs(u1 + s1 - u2) < eps or abs(u2 + s2 - u1) < eps
+    touch_v = abs(v1 + s1 - v2) < eps or abs(v2 + s2 - v1) < eps
+    return (overlap_u and touch_v) or (overlap_v and touch_u)
+
+
+def refine_quadtree(out_directory: str, scores: dict, settings: dict) -> list[tuple[float, float]]:
+    """Subdivide the cells of the last level of the quadtree whose score, or score difference with a neighbouring
+    cell, exceeds the thresholds of the settings
+
+    Args:
+        out_directory: output directory
+        scores: dict of {point index: score} of the cells which have not been subdivided
+        settings: refinement settings, see DEFAULT_REFINE_SETTINGS
+
+    Returns:
+        List of (x,y) coordinates of the points of the new cells, whose indexes follow the points of the quadtree
+    """
+    corners, cells = load_quadtree(out_directory)
+    current = leaves(cells)
+    level = max(cell["level"] for cell in cells)
+    if level >= settings["depth"]:
+        return []
+
+    values = [scores[cell["point"]] for cell in current if cell["point"] in scores]
+    low, high = min(values, default=0), max(values, default=0)
+    if high <= low:
+        return []
+    norm = {cell["point"]: (scores[cell["point"]] - low) / (high - low) for cell in current if cell["point"] in scores}
+
+    new_cells = []
+    next_point = len(cells)
+    for cell in current:
+        if cell["level"] != level or cell["point"] not in norm:
+            continue
+        score = norm[cell["point"]]
+        gradient = max(
+            (
+                abs(score - norm[other["point"]])
+                for other in current
+                if other["point"] in norm and _adjacent(cell, other)
+            ),
+            default=0,
+        )
+        if score < settings["threshold"] and gradient < settings["gradient"]:
+            continue
+
+        cell["split"] = True
+        size = cell["size"] / 2
+        for du, dv in [(0, 0), (1, 0), (0, 1), (1, 1)]:
+            new_cells.append(
+                {
+                    "u": cell["u"] + du * size,
+                    "v": cell["v"] + dv * size,
+                    "size": size,
+                    "level": level + 1,
+                    "point": next_point,
+                    "split": False,
+                }
+            )
+            next_point += 1
+
+    cells.extend(new_cells)
+    _save(out_directory, corners, cells)
+    return [cell_center(corners, cell) for cell in new_cells]
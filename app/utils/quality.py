@@ -0,0 +1,143 @@
+import json
+import os
+
+import numpy as np
+
+QUALITY_FILE = "quality.json"
+
+# Default settings of the trace quality filter
+DEFAULT_QUALITY_SETTINGS = {
+    "clip": 0.98,  # fraction of the full range of the samples from which a trace is clipped (null to disable)
+    "noise_floor": None,  # minimum RMS of a recentered trace, in volts (flat traces of missed triggers)
+    "min_correlation": None,  # minimum correlation of a trace with the running mean of the point
+    "min_traces": 10,  # number of accepted traces of a point before the correlation is checked
+    "reject_errors": False,  # whether runs where the target board reported errors are rejected
+    "retries": 5,  # maximum number of times a run is done again, before its last trace is kept anyway
+}
+
+# Reasons for rejecting a trace
+REASONS = ("clipped", "flat", "uncorrelated", "errors", "misaligned")
+
+
+def parse_quality(settings: dict) -> dict:
+    """Check the settings of the quality filter, using default values for missing settings"""
+    settings = {**DEFAULT_QUALITY_SETTINGS, **settings}
+    for key in settings:
+        if key not in DEFAULT_QUALITY_SETTINGS:
+            raise ValueError(f"Unknown quality setting: {key}")
+    if not isinstance(settings["retries"], int) or settings["retries"] < 0:
+        raise ValueError(f"Invalid quality retries: {settings['retries']}")
+    return settings
+
+
+class QualityFilter:
+    """
+    Validation of the traces of a point: saturation at the limits of the samples, RMS below a noise floor,
+    correlation with the running mean of the accepted traces, and errors reported by the target board.
+    Rejections are counted for each reason, along with the runs whose retries have been exhausted.
+    """
+
+    def __init__(self, settings: dict, y_mult: float = 1):
+        """Initialize the filter of a point
+
+        Args:
+            settings: quality settings, see DEFAULT_QUALITY_SETTINGS
+            y_mult: volts per unit of the traces of the point
+        """
+        self.settings = settings
+        self.y_mult = y_mult
+        self.counters = {reason: 0 for reason in (*REASONS, "exhausted")}
+        self._count = 0
+        self._sum = None
+
+    def check(self, errors: int, data: np.ndarray) -> str:
+        """Check a trace
+
+        Args:
+            errors: number of errors of the run
+            data: measured data of the run, of shape (samples,) or (channels, samples)
+
+        Returns:
+            The reason for rejecting the trace (see REASONS), or None if the trace is valid
+        """
+        if self.settings["reject_errors"] and errors:
+            return "errors"
+
+        if self.settings["clip"] is not None and np.issubdtype(data.dtype, np.integer):
+            limit = self.settings["clip"] * np.iinfo(data.dtype).max
+            if np.abs(data.astype(np.int64)).max() >= limit:
+                return "clipped"
+
+        trace = data.reshape(-1, data.shape[-1])[0].astype(np.float64)
+        centered = trace - trace.mean()
+        noise_floor = self.settings["noise_floor"]
+        if noise_floor is not None and np.sqrt(np.mean(centered**2)) * abs(self.y_mult) < noise_floor:
+            return "flat"
+
+        if self.settings["min_correlation"] is not None and self._count >= self.settings["min_traces"]:
+            mean = self._sum / self._count
+            mean = mean - mean.mean()
+            norm = np.linalg.norm(centered) * np.linalg.norm(mean)
+            if norm == 0 or centered @ mean / norm < self.settings["min_correlation"]:
+                return "uncorrelated"
+        return None
+
+    def reject(self, reason: str):
+        """Count a rejected trace"""
+        self.counters[reason] += 1
+
+    def accept(self, data: np.ndarray, exhausted: bool = False):
+        """Add a stored trace to the running mean
+
+        Args:
+            data: measured data of the run
+            exhausted: whether the trace is kept because the retries of the run have been exhausted
+        """
+        if exhausted:
+            self.counters["exhausted"] += 1
+            return
+        trace = data.reshape(-1, data.shape[-1])[0].astype(np.float64)
+        self._sum = trace if self._sum is None else self._sum + trace
+        self._count += 1
+
+
+def save_counters(out_directory: str, filename: str, counters: dict):
+    """Add the rejection counters of a point to the counters of the acquisition, saved atomically
+
+    Args:
+        out_directory: output directory
+        filename: base name of the files of the point
+        counters: dict of {reason: number of rejected traces}
+    """
+    quality = load_counters(out_directory)
+    previous = quality.get(filename, {})
+    quality[filename] = {reason: previous.get(reason, 0) + count for reason, count in counters.items()}
+    path = os.path.join(out_directory, QUALITY_FILE)
+    with open(path + ".tmp", mode="w") as f:
+        f.write(json.dumps(quality, indent=4))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def remove_counters(out_directory: str):
+    """Remove the rejection counters of a previous acquisition from an output directory"""
+    path = os.path.join(out_directory, QUALITY_FILE)
+    if os.path.isfile(path):
+        os.remove(path)
+
+
+def load_counters(out_directory: str) -> dict:
+    """Load the rejection counters of an acquisition
+
+    Args:
+        out_directory: output directory
+
+    Returns:
+        Dict of {filename: {reason: number of rejected traces}} for each point
+    """
+    path = os.path.join(out_directory, QUALITY_FILE)
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.loads(f.read())
@@ -0,0 +1,187 @@
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Policies of the consumers when they fall behind the producer
+BLOCK = "block"  # the producer waits for the consumer: no frame is lost
+DROP = "drop"  # the consumer skips the oldest frames to catch up with the producer
+
+_POLL_INTERVAL = 0.0005
+
+
+class RingBuffer:
+    """
+    Single-producer ring buffer of fixed-size frames in shared memory, readable from other processes.
+
+    The buffer starts with a header of int64 counters: the number of published frames, a closed flag, then
+    one read cursor per consumer. Frames follow the header, as a numpy structured array.
+    """
+
+    def __init__(self, name: str, dtype: np.dtype, capacity: int, policies: list[str], create: bool = False):
+        """Create or attach to a ring buffer. Use RingBuffer.create() and RingBuffer.attach() instead
+
+        Args:
+            name: name of the shared memory block
+            dtype: numpy dtype of a frame
+            capacity: number of frames of the buffer
+            policies: policy of each consumer (BLOCK or DROP)
+            create: whether the shared memory block must be created
+        """
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+        self.policies = policies
+        header_size = 8 * (2 + len(policies))
+        size = header_size + self.dtype.itemsize * capacity
+        self._shm = shared_memory.SharedMemory(name=name, create=create, size=size if create else 0)
+        self._header = np.ndarray((2 + len(policies),), dtype=np.int64, buffer=self._shm.buf)
+        self.frames = np.ndarray((capacity,), dtype=self.dtype, buffer=self._shm.buf, offset=header_size)
+        if create:
+            self._header[:] = 0
+
+    @classmethod
+    def create(cls, dtype: np.dtype, capacity: int, policies: list[str]) -> "RingBuffer":
+        """Create a new ring buffer
+
+        Args:
+            dtype: numpy dtype of a frame
+            capacity: number of frames of the buffer
+            policies: policy of each consumer (BLOCK or DROP)
+
+        Returns:
+            The ring buffer, owned by the producer
+        """
+        return cls(None, dtype, capacity, policies, create=True)
+
+    @classmethod
+    def attach(cls, spec: tuple) -> "RingBuffer":
+        """Attach to an existing ring buffer, eg: from another process
+
+        Args:
+            spec: result of RingBuffer.spec() of the existing ring buffer
+
+        Returns:
+            The ring buffer
+        """
+        name, descr, capacity, policies = spec
+        return cls(name, np.dtype(descr), capacity, policies)
+
+    def spec(self) -> tuple:
+        """Get a picklable description of the ring buffer, to attach to it from another process"""
+        return self._shm.name, self.dtype.descr, self.capacity, self.policies
+
+    @property
+    def published(self) -> int:
+        """Number of frames published since the creation of the buffer"""
+        return int(self._header[0])
+
+    @property
+    def closed(self) -> bool:
+        """Whether the producer has closed the buffer"""
+        return bool(self._header[1])
+
+    def cursor(self, consumer: int) -> int:
+        """Get the read cursor of a consumer"""
+        return int(self._header[2 + consumer])
+
+    def set_cursor(self, consumer: int, cursor: int):
+        """Set the read cursor of a consumer"""
+        self._header[2 + consumer] = cursor
+
+    def reserve(self, is_alive=lambda: True) -> np.ndarray:
+        """Wait for a free frame. The frame must be filled then published with publish()
+
+        Args:
+            is_alive: function returning False to stop waiting for slow consumers
+
+        Returns:
+            The frame to fill (a view on the shared memory), or None if waiting has been stopped
+        """
+        seq = self.published
+        for consumer, policy in enumerate(self.policies):
+            while policy == BLOCK and seq - self.cursor(consumer) >= self.capacity:
+                if not is_alive():
+                    return None
+                time.sleep(_POLL_INTERVAL)
+        return self.frames[seq % self.capacity]
+
+    def drained(self) -> bool:
+        """Check if every BLOCK consumer has read every published frame. DROP consumers may lag by design"""
+        return all(
+            self.cursor(consumer) >= self.published for consumer, policy in enumerate(self.policies) if policy == BLOCK
+        )
+
+    def publish(self):
+        """Publish the frame returned by reserve()"""
+        self._header[0] += 1
+
+    def close(self):
+        """Mark the buffer as closed: consumers stop once they have read every published frame"""
+        self._header[1] = 1
+
+    def release(self):
+        """Release the shared memory of this process"""
+        self.frames = None
+        self._header = None
+        self._shm.close()
+
+    def unlink(self):
+        """Destroy the shared memory block. Must be called once, by the producer"""
+        self._shm.unlink()
+
+
+class Consumer:
+    """Read cursor of a consumer of a RingBuffer"""
+
+    def __init__(self, ring: RingBuffer, consumer: int):
+        """Initialize the consumer
+
+        Args:
+            ring: the ring buffer to read
+            consumer: index of the consumer, in the policies of the ring buffer
+        """
+        self.ring = ring
+        self.consumer = consumer
+        self.dropped = 0
+
+    def peek(self, max_frames: int | None = None, timeout: float | None = None) -> np.ndarray:
+        """Wait for published frames
+
+        Args:
+            max_frames: maximum number of frames to return
+            timeout: maximum time to wait for a frame, in seconds
+
+        Returns:
+            A view on the next contiguous frames of the shared memory (may be empty).
+            Frames must be released with release() once processed
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            seq, cursor = self.ring.published, self.ring.cursor(self.consumer)
+            if self.ring.policies[self.consumer] == DROP and seq - cursor > self.ring.capacity // 2:
+                self.dropped += seq - self.ring.capacity // 2 - cursor
+                cursor = seq - self.ring.capacity // 2
+                self.ring.set_cursor(self.consumer, cursor)
+            if seq > cursor:
+                break
+            if self.ring.closed or (deadline is not None and time.monotonic() > deadline):
+                return self.ring.frames[:0]
+            time.sleep(_POLL_INTERVAL)
+
+        start = cursor % self.ring.capacity
+        stop = min(self.ring.capacity, start + seq - cursor)
+        if max_frames is not None:
+            stop = min(stop, start + max_frames)
+        return self.ring.frames[start:stop]
+
+    def release(self, n: int):
+        """Release frames returned by peek(), which may then be overwritten by the producer
+
+        Args:
+            n: number of frames to release
+        """
+        self.ring.set_cursor(self.consumer, self.ring.cursor(self.consumer) + n)
+
+    def finished(self) -> bool:
+        """Check if the producer has closed the buffer and every frame has been read"""
+        return self.ring.closed and self.ring.cursor(self.consumer) >= self.ring.published
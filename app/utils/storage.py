@@ -0,0 +1,322 @@
+import os
+
+import numpy as np
+
+MEASURES_EXT = "measures.bin"
+SUMMARY_EXT = "summary.npz"
+LABELS_EXT = "labels.bin"
+
+# Size of the binary labels of a measure: key, text and result of a 16 bytes block
+LABEL_SIZE = 48
+
+# Maximum fraction of runs with errors for which the error counts of a point are stored as sparse (run, count) pairs
+SPARSE_ERRORS = 0.5
+
+
+def point_filename(x: float, y: float) -> str:
+    """Get the base name of the files of a point
+
+    Args:
+        x, y: coordinates of the point
+
+    Returns:
+        The base name of the files of the point
+    """
+    return f"{x}_{y}"
+
+
+def point_coords(filename: str) -> tuple[float, float]:
+    """Get the coordinates of a point from the base name of its files
+
+    Args:
+        filename: base name of the files of the point
+
+    Returns:
+        The (x,y) coordinates of the point
+    """
+    x, y = filename.split("_")
+    return float(x), float(y)
+
+
+def list_points(out_directory: str) -> list[str]:
+    """List the points stored in an output directory
+
+    Args:
+        out_directory: output directory
+
+    Returns:
+        List of the base names of the files of each point
+    """
+    return sorted(
+        file[: -len(SUMMARY_EXT) - 1] for file in os.listdir(out_directory) if file.endswith(f".{SUMMARY_EXT}")
+    )
+
+
+def write_summary(out_directory: str, filename: str, **arrays):
+    """Write the summary of a point atomically
+
+    Args:
+        out_directory: output directory
+        filename: base name of the files of the point
+        arrays: content of the summary
+    """
+    path = os.path.join(out_directory, f"{filename}.{SUMMARY_EXT}")
+    with open(path + ".tmp", mode="wb") as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def read_summary(out_directory: str, filename: str) -> dict:
+    """Read the summary of a point
+
+    Args:
+        out_directory: output directory
+        filename: base name of the files of the point
+
+    Returns:
+        Dict of the arrays of the summary, or None if the point has no summary
+    """
+    path = os.path.join(out_directory, f"{filename}.{SUMMARY_EXT}")
+    if not os.path.isfile(path):
+        return None
+    with np.load(path) as summary:
+        return dict(summary)
+
+
+def measures_file(filename: str, channel: str | None = None) -> str:
+    """Get the name of the measures file of a point
+
+    Args:
+        filename: base name of the files of the point
+        channel: channel of the measures, for points acquired on several channels
+
+    Returns:
+        The name of the measures file
+    """
+    return f"{filename}.{channel}.{MEASURES_EXT}" if channel else f"{filename}.{MEASURES_EXT}"
+
+
+def _channel_index(summary: dict, channel: str | None = None) -> int:
+    """Get the index of a channel in the summary of a point, or None if the point has a single channel"""
+    if "channels" not in summary:
+        return None
+    channels = [str(name) for name in summary["channels"]]
+    return channels.index(channel) if channel is not None else 0
+
+
+def load_measures(
+    out_directory: str, filename: str, summary: dict | None = None, channel: str | None = None
+) -> np.ndarray:
+    """Load the measures of a point, as a read-only memory map
+
+    Args:
+        out_directory: output directory
+        filename: base name of the files of the point
+        summary: summary of the point, read if not given
+        channel: channel of the measures, the first channel by default for points acquired on several channels
+
+    Returns:
+        Array of measures, of shape (traces, samples)
+    """
+    summary = summary if summary is not None else read_summary(out_directory, filename)
+    dtype, samples = np.dtype(str(summary["dtype"])), int(summary["samples"])
+    index = _channel_index(summary, channel)
+    channel = str(summary["channels"][index]) if index is not None else None
+    path = os.path.join(out_directory, measures_file(filename, channel))
+    count = os.path.getsize(path) // (dtype.itemsize * samples) if os.path.isfile(path) else 0
+    if count == 0:
+        return np.zeros((0, samples), dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(count, samples))
+
+
+def parse_info(lines: list[bytes]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Parse the key, plaintext and ciphertext of measures, from the information returned by the target board
+    (hexadecimal key, text and result separated by spaces, eg: ChipWhisperer). The class of the measures
+    in fixed-vs-random mode, which follows the result, is ignored
+
+    Args:
+        lines: information of each measure
+
+    Returns:
+        Tuple of (keys, plaintexts, ciphertexts), uint8 arrays of shape (traces, block size)
+    """
+    if not len(lines):
+        return tuple(np.zeros((0, 16), dtype=np.uint8) for _ in range(3))
+    if len(lines[0].split()) > 3:
+        lines = [line.rsplit(maxsplit=1)[0] for line in lines]
+    values = np.frombuffer(bytes.fromhex(b"".join(lines).replace(b" ", b"").decode()), dtype=np.uint8)
+    values = values.reshape(len(lines), 3, -1)
+    return values[:, 0], values[:, 1], values[:, 2]
+
+
+def labels_file(filename: str) -> str:
+    """Get the name of the binary labels file of a point
+
+    Args:
+        filename: base name of the files of the point
+
+    Returns:
+        The name of the labels file
+    """
+    return f"{filename}.{LABELS_EXT}"
+
+
+def label_width(summary: dict) -> int:
+    """Get the size of the rows of the binary labels file of a point: the key is not repeated when it is fixed
+
+    Args:
+        summary: summary of the point
+
+    Returns:
+        Size of the labels of a measure, in bytes
+    """
+    return LABEL_SIZE - 16 if "key" in summary else LABEL_SIZE
+
+
+def load_labels(
+    out_directory: str, filename: str, summary: dict | None = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Load the binary labels of a point, as read-only memory maps. A fixed key is stored once in the summary
+
+    Args:
+        out_directory: output directory
+        filename: base name of the files of the point
+        summary: summary of the point, read if not given
+
+    Returns:
+        Tuple of (keys, plaintexts, ciphertexts), uint8 arrays of shape (traces, block size)
+    """
+    summary = summary if summary is not None else read_summary(out_directory, filename)
+    width = label_width(summary)
+    path = os.path.join(out_directory, labels_file(filename))
+    count = os.path.getsize(path) // width
+    labels = (
+        np.memmap(path, dtype=np.uint8, mode="r", shape=(count, width))
+        if count
+        else np.zeros((0, width), dtype=np.uint8)
+    )
+    if "key" in summary:
+        keys = np.broadcast_to(summary["key"].astype(np.uint8), (count, 16))
+        return keys, labels[:, :16], labels[:, 16:]
+    return labels[:, :16], labels[:, 16:32], labels[:, 32:]
+
+
+def load_info(out_directory: str, filename: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Load the key, plaintext and ciphertext of each measure of a point, from its binary labels (see load_labels())
+    or from the information returned by the target board (see parse_info())
+
+    Args:
+        out_directory: output directory
+        filename: base name of the files of the point
+
+    Returns:
+        Tuple of (keys, plaintexts, ciphertexts), uint8 arrays of shape (traces, block size)
+    """
+    if os.path.isfile(os.path.join(out_directory, labels_file(filename))):
+        return load_labels(out_directory, filename)
+    with open(os.path.join(out_directory, f"{filename}.info.txt"), mode="rb") as f:
+        return parse_info(f.read().splitlines())
+
+
+def pack_errors(errors: np.ndarray) -> dict:
+    """Pack the error counts of the runs of a point, for its summary: int32 counts of every run, or sparse int32
+    (run, count) pairs of the runs with errors when most runs have none
+
+    Args:
+        errors: error count of each run
+
+    Returns:
+        Dict of summary arrays: "runs", and "errors" or "errors_index" and "errors_count"
+    """
+    errors = np.asarray(errors, dtype=np.int32)
+    index = np.flatnonzero(errors).astype(np.int32)
+    if len(index) > SPARSE_ERRORS * len(errors):
+        return {"runs": len(errors), "errors": errors}
+    return {"runs": len(errors), "errors_index": index, "errors_count": errors[index]}
+
+
+def unpack_errors(summary: dict) -> np.ndarray:
+    """Get the error counts packed in the summary of a point, see pack_errors()
+
+    Args:
+        summary: summary of the point
+
+    Returns:
+        int32 array of the error count of each run, or None if the summary has no error counts
+    """
+    if "runs" not in summary:
+        return None
+    if "errors" in summary:
+        return summary["errors"].astype(np.int32)
+    errors = np.zeros(int(summary["runs"]), dtype=np.int32)
+    errors[summary["errors_index"]] = summary["errors_count"]
+    return errors
+
+
+def load_errors(out_directory: str, filename: str, summary: dict | None = None) -> np.ndarray:
+    """Load the error count of each run of a point, from its summary or from the text file of older acquisitions
+
+    Args:
+        out_directory: output directory
+        filename: base name of the files of the point
+        summary: summary of the point, read if not given
+
+    Returns:
+        Array of the error count of each run
+    """
+    summary = summary if summary is not None else read_summary(out_directory, filename)
+    errors = unpack_errors(summary) if summary is not None else None
+    if errors is not None:
+        return errors
+    path = os.path.join(out_directory, f"{filename}.errors.txt")
+    if not os.path.isfile(path):
+        return np.zeros(0, dtype=np.int32)
+    with open(path) as f:
+        return np.array([np.fromstring(line, sep=",").mean() for line in f.read().splitlines()])
+
+
+def get_mean(summary: dict, channel: str | None = None) -> np.ndarray:
+    """Get the mean trace of a point acquired in average capture, averaged by the oscilloscope
+
+    Args:
+        summary: summary of the point
+        channel: channel of the measures, the first channel by default for points acquired on several channels
+
+    Returns:
+        The mean trace, or None if the point has not been acquired in average capture
+    """
+    if "mean" not in summary:
+        return None
+    index = _channel_index(summary, channel)
+    return summary["mean"] if index is None else summary["mean"][index]
+
+
+def get_scaling(summary: dict, channel: str | None = None) -> np.ndarray:
+    """Get the scaling of the measures of a point
+
+    Args:
+        summary: summary of the point
+        channel: channel of the measures, the first channel by default for points acquired on several channels
+
+    Returns:
+        Array of (y_mult, y_offset, y_zero, x_increment), see the get_scaling() method of the oscilloscopes
+    """
+    index = _channel_index(summary, channel)
+    return summary["scaling"] if index is None else summary["scaling"][index]
+
+
+def to_volts(measures: np.ndarray, summary: dict, channel: str | None = None) -> np.ndarray:
+    """Convert measures to volts, using the vertical scaling recorded with them
+
+    Args:
+        measures: array of measures of a point
+        summary: summary of the point
+        channel: channel of the measures, the first channel by default for points acquired on several channels
+
+    Returns:
+        The measures in volts
+    """
+    y_mult, y_offset, y_zero = get_scaling(summary, channel)[:3]
+    return (measures.astype(np.float64) - y_offset) * y_mult + y_zero